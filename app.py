@@ -1,18 +1,44 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import time
+IMPORT_STARTED = time.perf_counter()  # cold-start clock, before the heavy imports
+
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-import pickle
+import json
 import numpy as np
 import os
-import chromadb
-from chromadb.utils import embedding_functions
+import threading
+from collections import Counter
+from types import SimpleNamespace
+from knn_engine import KNN_DIRNAME, NumpyKNN
+from labeling import label_batch
+from metrics import Registry
+from lazy_resource import ReloadWatcher, VersionedResource
+from micro_batcher import MicroBatcher
+from model_bundle import load_model
+from near_duplicates import DUPLICATES_FILE, MAX_DISTANCE, NearDuplicateLookup
+from prototypes import PROTOTYPES_FILE, Prototypes
+from request_profiler import PROFILE_DIR, RequestProfiler, aggregate
+from result_cache import ResultCache, text_key
+from version_stamps import INDEX_STAMP, MODEL_STAMP, current_index_dir, read_stamp
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key')
 
+# --- Metrics ---
+# Latency histograms and counters, served in the Prometheus text format at
+# /metrics. An observation is a bisect and an increment under a lock, cheap
+# enough to leave on. Set METRICS_TOKEN to require a bearer token to scrape.
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+metrics_registry = Registry()
+stage_seconds = metrics_registry.histogram('email_stage_seconds', 'Time spent in each classification stage.', ['stage'])
+request_seconds = metrics_registry.histogram('http_request_seconds', 'Request latency by endpoint.',
+                                             ['endpoint', 'method', 'status'])
+errors_total = metrics_registry.counter('email_errors_total', 'Failures by stage.', ['stage'])
+
 # --- Database Configuration (SQLite) ---
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
@@ -29,33 +55,448 @@ class User(UserMixin, db.Model):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    with stage_seconds.time('load_user'):
+        return User.query.get(int(user_id))
 
 # --- Vector Database Setup (ChromaDB) ---
-try:
-    chroma_client = chromadb.PersistentClient(path="chroma_db")
-    sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
-    collection = chroma_client.get_collection(name="email_collection", embedding_function=sentence_transformer_ef)
-    print("Connected to ChromaDB.")
-except Exception as e:
-    print(f"Warning: Could not connect to ChromaDB. Ensure init_vectordb.py has been run. Error: {e}")
-    collection = None
-
-# --- Helper Functions ---
-def auto_label(text):
-    """Heuristic to label emails based on keywords."""
-    text = text.lower()
-    financial_keywords = ['budget', 'invoice', 'purchase', 'financial', 'report', 'quarterly', 'bank', 'money', 'expense', 'cost', 'payment', 'transaction', 'audit', 'billing']
-    urgent_keywords = ['urgent', 'immediate', 'emergency', 'deadline', 'breach', 'asap', 'critical', 'alert', 'warning', 'high priority', 'immediate action']
-    hr_keywords = ['hr', 'policies', 'performance', 'review', 'insurance', 'promotion', 'holiday', 'leave', 'benefits', 'hiring', 'salary', 'recruitment', 'onboarding', 'resignation', 'interview']
-    
-    for word in urgent_keywords:
-        if word in text: return 'Urgent'
-    for word in financial_keywords:
-        if word in text: return 'Financial'
-    for word in hr_keywords:
-        if word in text: return 'HR'
-    return 'General'
+# The embedding model and the Chroma client take seconds to load, so they are
+# created on first use rather than at import; login and register never pay
+# for them. APP_PRELOAD / APP_WARMUP below load them up front instead. Each
+# index version lives in its own directory; when init_vectordb.py stamps a
+# new one, it is opened in the background and swapped in (see Hot Reload
+# below) while requests in flight finish on the old one.
+#
+# 'chroma' queries the collection; 'numpy' searches the matrix exported by
+# `init_vectordb.py --export-npy`, memory-mapped and shared by all workers.
+app.config['VECTOR_BACKEND'] = os.environ.get('VECTOR_BACKEND', 'chroma')
+# 'knn' votes over the 5 nearest emails; 'prototype' compares the email with
+# the category prototypes built by init_vectordb.py and only searches for
+# neighbors when the best two categories score within PROTOTYPE_MARGIN.
+app.config['VECTOR_MODE'] = os.environ.get('VECTOR_MODE', 'knn')
+app.config['PROTOTYPE_MARGIN'] = float(os.environ.get('PROTOTYPE_MARGIN', '0.05'))
+
+def _load_vector_store(ef=None):
+    store = SimpleNamespace(ef=ef, client=None, collection=None, knn_index=None, prototypes=None, duplicates=None)
+    path = current_index_dir()
+    try:
+        # Imported here so a missing or broken chromadb degrades like a
+        # missing index instead of failing every request that reaches it.
+        import chromadb
+        from chromadb.utils import embedding_functions
+
+        if store.ef is None:
+            store.ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
+        store.client = chromadb.PersistentClient(path=path)
+        store.collection = store.client.get_collection(name="email_collection", embedding_function=store.ef)
+        print("Connected to ChromaDB.")
+    except Exception as e:
+        print(f"Warning: Could not connect to ChromaDB. Ensure init_vectordb.py has been run. Error: {e}")
+
+    if app.config['VECTOR_BACKEND'] == 'numpy' and store.ef is not None:
+        try:
+            store.knn_index = NumpyKNN(os.path.join(path, KNN_DIRNAME))
+            print(f"Loaded NumPy kNN index ({len(store.knn_index)} vectors, {store.knn_index.meta['dtype']}).")
+        except Exception as e:
+            print(f"Warning: Could not load {os.path.join(path, KNN_DIRNAME)}. Run init_vectordb.py --export-npy. Falling back to ChromaDB. Error: {e}")
+
+    if app.config['VECTOR_MODE'] == 'prototype' and store.ef is not None:
+        try:
+            store.prototypes = Prototypes(os.path.join(path, PROTOTYPES_FILE))
+            print(f"Loaded {len(store.prototypes)} category prototypes.")
+        except Exception as e:
+            print(f"Warning: Could not load {os.path.join(path, PROTOTYPES_FILE)}. Run init_vectordb.py. Falling back to kNN. Error: {e}")
+
+    # The SimHash signatures of this index version, like the kNN export and
+    # the prototypes above. An email that is a
+    # (near-)copy of an indexed one is answered with that email's label
+    # without being embedded.
+    try:
+        store.duplicates = NearDuplicateLookup(os.path.join(path, DUPLICATES_FILE))
+    except Exception as e:
+        print(f"Warning: No near-duplicate index. Run init_vectordb.py to enable it. Error: {e}")
+    return store
+
+def _reload_vector_store(previous):
+    # The embedding model does not change with the index; keep it.
+    store = _load_vector_store(ef=previous.ef)
+    if store.collection is None:
+        raise RuntimeError("could not open the new collection")
+    if app.config['VECTOR_BACKEND'] == 'numpy' and store.knn_index is None:
+        raise RuntimeError(f"could not load {KNN_DIRNAME}")
+    if app.config['VECTOR_MODE'] == 'prototype' and store.prototypes is None:
+        raise RuntimeError(f"could not load {PROTOTYPES_FILE}")
+    if 'duplicate' in app.config['CASCADE_TIERS'] and store.duplicates is None:
+        raise RuntimeError(f"could not load {DUPLICATES_FILE}")
+    # Chroma caches one client per directory for the life of the process.
+    # Forgetting them does not stop the clients already open, so the old
+    # version keeps serving its requests and is freed after the last one.
+    store.client.clear_system_cache()
+    return store
+
+vector_store = VersionedResource('vector_store', _load_vector_store, lambda: read_stamp(INDEX_STAMP),
+                                 reloader=_reload_vector_store,
+                                 warm=lambda store: _classify_vectors(store, ["warmup"]))
+
+def vector_ready():
+    store = vector_store.get()
+    return store.knn_index is not None or store.collection is not None
+
+def nearest_categories(email_texts, where=None):
+    """(tier, categories) per input text: the categories of the nearest
+    indexed emails, or the single category of the closest prototype.
+
+    Goes through the micro-batcher, so concurrent requests share one
+    embedding forward pass and one search. A ``where`` filter on the stored
+    header metadata (e.g. ``{"from": "jeff.skilling@enron.com"}``) is sent
+    straight to ChromaDB, which is the only backend that has it.
+    """
+    if where:
+        with vector_store.lease() as store:
+            return [('vector', categories) for categories in _nearest_categories_batch(store, email_texts, where=where)]
+    return vector_batcher.map(email_texts)
+
+def _vector_batch(email_texts):
+    # The lease keeps one index version for the whole batch, even if a
+    # reload swaps in a new one meanwhile.
+    with vector_store.lease() as store:
+        return _classify_vectors(store, email_texts)
+
+def _classify_vectors(store, email_texts):
+    if store.prototypes is None:
+        return [('vector', categories) for categories in _nearest_categories_batch(store, email_texts)]
+    embeddings = _embed(store, email_texts)
+    with stage_seconds.time('prototype'):
+        labels, margins = store.prototypes.classify(embeddings)
+    results = [('prototype', [label]) for label in labels]
+    unsure = np.flatnonzero(margins < app.config['PROTOTYPE_MARGIN'])
+    if len(unsure):
+        for i, categories in zip(unsure, _nearest_categories_batch(store, embeddings=embeddings[unsure])):
+            results[i] = ('vector', categories)
+    return results
+
+def _embed(store, email_texts):
+    with stage_seconds.time('embed'):
+        return np.asarray(store.ef(email_texts), dtype=np.float32)
+
+def _nearest_categories_batch(store, email_texts=None, n_results=5, where=None, embeddings=None):
+    # Texts are embedded here rather than inside Chroma so the embedding and
+    # the search are timed separately.
+    if where and store.collection is None:
+        raise RuntimeError("Metadata filters need the ChromaDB collection")
+    if embeddings is None:
+        embeddings = _embed(store, email_texts)
+    with stage_seconds.time('search'):
+        if store.knn_index is not None and not where:
+            return store.knn_index.neighbor_categories(embeddings, n_results)
+        results = store.collection.query(
+            query_embeddings=embeddings.tolist(),
+            n_results=n_results,
+            where=where or None
+        )
+    # Get categories of nearest neighbors
+    return [[m['category'] for m in metadatas] for metadatas in results['metadatas']]
+
+# Request threads queue their texts; one background thread embeds whatever
+# arrived within the window (or up to the batch limit) in a single call.
+# VECTOR_BATCH_WINDOW_MS=0 disables batching.
+app.config['VECTOR_MAX_BATCH'] = int(os.environ.get('VECTOR_MAX_BATCH', '64'))
+app.config['VECTOR_BATCH_WINDOW_MS'] = float(os.environ.get('VECTOR_BATCH_WINDOW_MS', '5'))
+vector_batcher = MicroBatcher(_vector_batch, app.config['VECTOR_MAX_BATCH'], app.config['VECTOR_BATCH_WINDOW_MS'])
+
+# --- Request Profiler ---
+# Off unless PROFILE_SAMPLE_PERCENT or PROFILE_TOKEN is set. A request sent
+# with `X-Profile: <PROFILE_TOKEN>` is always profiled. Stack samples cover
+# the request thread and the micro-batcher thread, where embedding and the
+# vector search actually run.
+app.config['PROFILE_SAMPLE_PERCENT'] = float(os.environ.get('PROFILE_SAMPLE_PERCENT', '0'))
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+
+def _batcher_thread():
+    thread = vector_batcher.thread
+    return {thread.ident: 'micro-batcher'} if thread is not None and thread.is_alive() else {}
+
+profiler = RequestProfiler(
+    PROFILE_DIR,
+    sample_percent=app.config['PROFILE_SAMPLE_PERCENT'],
+    token=app.config['PROFILE_TOKEN'],
+    ring_size=int(os.environ.get('PROFILE_RING_SIZE', '200')),
+    interval_ms=float(os.environ.get('PROFILE_INTERVAL_MS', '2')),
+    use_cprofile=os.environ.get('PROFILE_CPROFILE') == '1',
+    extra_threads=_batcher_thread,
+)
+
+# --- TF-IDF Model Setup ---
+def _load_tfidf():
+    try:
+        model, vectorizer = load_model()
+        print(f"Loaded TF-IDF model {getattr(model, 'version', '(legacy pickle)')}.")
+    except Exception as e:
+        print(f"Warning: Could not load the model bundle. Run train_model.py to enable the model tier. Error: {e}")
+        model = vectorizer = None
+    return SimpleNamespace(model=model, vectorizer=vectorizer)
+
+def _reload_tfidf(previous):
+    # Unlike the first load, a failure here raises, so the working model stays.
+    model, vectorizer = load_model()
+    return SimpleNamespace(model=model, vectorizer=vectorizer)
+
+def _warm_tfidf(resources):
+    resources.model.predict_proba(resources.vectorizer.transform(["warmup"]))
+
+tfidf = VersionedResource('tfidf_model', _load_tfidf, lambda: read_stamp(MODEL_STAMP), reloader=_reload_tfidf,
+                          warm=_warm_tfidf)
+
+# --- Cascade Configuration ---
+# Tiers run in this order; an email leaves the cascade at the first tier that
+# is sure about it. The model is trusted when its top class probability
+# reaches the threshold, otherwise the email goes on to the near-duplicate
+# lookup and then vector search.
+app.config['CASCADE_TIERS'] = os.environ.get('CASCADE_TIERS', 'heuristic,model,duplicate,vector').split(',')
+app.config['MODEL_CONFIDENCE_THRESHOLD'] = float(os.environ.get('MODEL_CONFIDENCE_THRESHOLD', '0.6'))
+app.config['NEAR_DUP_DISTANCE'] = int(os.environ.get('NEAR_DUP_DISTANCE', str(MAX_DISTANCE)))
+
+tier_counts = Counter()
+tier_counts_lock = threading.Lock()
+
+def record_tiers(results):
+    with tier_counts_lock:
+        for result in results:
+            tier_counts['cache' if result['cached'] else result['tier']] += 1
+
+def tier_hit_rates():
+    with tier_counts_lock:
+        counts = dict(tier_counts)
+    total = sum(counts.values())
+    return {tier: {'count': n, 'rate': n / total} for tier, n in counts.items()}
+
+# --- Hot Reload ---
+# Every HOT_RELOAD_INTERVAL seconds (0 disables) a request checks the version
+# stamps written by train_model.py (model_bundle/CURRENT) and
+# init_vectordb.py (chroma_db/index_version). A changed artifact is loaded
+# and warmed on a background thread while the old one keeps serving, then
+# swapped in; the old one is released once its last request is done.
+app.config['HOT_RELOAD_INTERVAL'] = float(os.environ.get('HOT_RELOAD_INTERVAL', '5'))
+artifact_watcher = ReloadWatcher([tfidf, vector_store], app.config['HOT_RELOAD_INTERVAL'])
+
+# --- Result Cache ---
+# Repeated emails (boilerplate, forwarded threads) skip the cascade. The cache
+# empties itself when a new model or index version is swapped in.
+app.config['RESULT_CACHE_SIZE'] = int(os.environ.get('RESULT_CACHE_SIZE', '10000'))
+app.config['RESULT_CACHE_TTL'] = float(os.environ.get('RESULT_CACHE_TTL', '0')) or None
+
+def artifact_version():
+    # The versions being served, not the stamps: answers from the old model
+    # stay valid until the new one is actually in use.
+    return (vector_store.version, tfidf.version)
+
+result_cache = ResultCache(app.config['RESULT_CACHE_SIZE'], app.config['RESULT_CACHE_TTL'], artifact_version)
+
+# --- Classification ---
+def classify_emails(email_texts, where=None):
+    """Classify a batch of emails, answering repeats from the result cache."""
+    use_cache = app.config['RESULT_CACHE_SIZE'] > 0
+    config_key = (f"{','.join(app.config['CASCADE_TIERS'])}|{app.config['MODEL_CONFIDENCE_THRESHOLD']}"
+                  f"|{app.config['NEAR_DUP_DISTANCE']}|{app.config['VECTOR_MODE']}|{app.config['PROTOTYPE_MARGIN']}")
+    if where:
+        config_key += '|' + json.dumps(where, sort_keys=True)
+    results = [None] * len(email_texts)
+    keys = [None] * len(email_texts)
+    misses = []
+    repeats = {}
+    cache_started = time.perf_counter()
+    for i, text in enumerate(email_texts):
+        if use_cache:
+            keys[i] = f"{config_key}|{text_key(text)}"
+            # The same email twice in one batch is classified once.
+            if keys[i] in repeats:
+                repeats[keys[i]].append(i)
+                continue
+            cached = result_cache.get(keys[i])
+            if cached is not None:
+                results[i] = dict(cached, cached=True)
+                continue
+            repeats[keys[i]] = []
+        misses.append(i)
+    if use_cache:
+        stage_seconds.observe(time.perf_counter() - cache_started, 'cache')
+
+    for i, result in zip(misses, run_cascade([email_texts[i] for i in misses], where)):
+        result['cached'] = False
+        results[i] = result
+        if use_cache:
+            for j in repeats[keys[i]]:
+                results[j] = dict(result, cached=True)
+            # Failures and fallbacks are not answers; let the next request
+            # try again.
+            if not result.get('degraded'):
+                result_cache.put(keys[i], result)
+
+    record_tiers(results)
+    return results
+
+def run_cascade(email_texts, where=None):
+    """Classify a batch of emails through the configured cascade.
+
+    The keyword heuristic runs over the whole batch first. What it calls
+    General goes through the TF-IDF model in one sparse transform. Emails
+    the model is unsure about are looked up in the near-duplicate index, and
+    only the rest are sent to the vector store, in micro-batches of at most
+    VECTOR_MAX_BATCH emails (or one filtered query when ``where`` is set).
+    Returns one dict per email with the label, the neighbor categories, the
+    model confidence (if the model ran) and the tier that decided. Emails
+    the vector tier should have settled but could not are marked
+    ``degraded``.
+    """
+    tiers = app.config['CASCADE_TIERS']
+    results = [{'label': 'General', 'neighbors': [], 'confidence': None, 'tier': 'none'} for _ in email_texts]
+    leftovers = list(range(len(email_texts)))
+
+    # 1. Try Heuristic First
+    if 'heuristic' in tiers:
+        remaining = []
+        with stage_seconds.time('heuristic'):
+            labels = label_batch(email_texts)
+        for i, heuristic_pred in zip(leftovers, labels):
+            results[i]['label'] = heuristic_pred
+            if heuristic_pred == 'General':
+                remaining.append(i)
+            else:
+                results[i]['tier'] = 'heuristic'
+        leftovers = remaining
+
+    # 2. TF-IDF Model
+    model = None
+    if leftovers and 'model' in tiers:
+        # One lease, so the model and its vectorizer come from the same bundle.
+        with tfidf.lease() as resources:
+            model = resources.model
+            if model is not None:
+                with stage_seconds.time('model'):
+                    probs = model.predict_proba(resources.vectorizer.transform([email_texts[i] for i in leftovers]))
+    if model is not None:
+        best = probs.argmax(axis=1)
+        threshold = app.config['MODEL_CONFIDENCE_THRESHOLD']
+        remaining = []
+        for i, label_idx, row in zip(leftovers, best, probs):
+            confidence = float(row[label_idx])
+            results[i].update(label=str(model.classes_[label_idx]), confidence=confidence, tier='model')
+            if confidence < threshold:
+                remaining.append(i)
+        leftovers = remaining
+
+    # 3. Near-Duplicate Lookup. Filters restrict neighbors by metadata, which
+    # the lookup cannot honour, so filtered requests skip it.
+    matches = None
+    if leftovers and 'duplicate' in tiers and not where:
+        # Signatures of the same index version the vector tier searches.
+        with vector_store.lease() as store:
+            if store.duplicates is not None:
+                with stage_seconds.time('duplicate'):
+                    matches = store.duplicates.lookup([email_texts[i] for i in leftovers], app.config['NEAR_DUP_DISTANCE'])
+    if matches is not None:
+        remaining = []
+        for i, match in zip(leftovers, matches):
+            if match is None:
+                remaining.append(i)
+            else:
+                results[i].update(label=match[1], neighbors=[match[1]], tier='duplicate')
+        leftovers = remaining
+
+    # 4. Vector Search (Semantic Classification)
+    if leftovers and 'vector' in tiers:
+        if vector_ready():
+            try:
+                # Includes any wait for the micro-batch to fill.
+                with stage_seconds.time('vector'):
+                    neighbors = nearest_categories([email_texts[i] for i in leftovers], where)
+                for i, (tier, categories) in zip(leftovers, neighbors):
+                    # Majority Vote
+                    prediction = max(set(categories), key=categories.count) if categories else "General"
+                    results[i].update(label=prediction, neighbors=categories, tier=tier)
+            except Exception as e:
+                # Emails the model already scored keep its (low-confidence) answer.
+                print(f"Vector DB Error: {e}")
+                errors_total.inc('vector')
+                for i in leftovers:
+                    results[i]['degraded'] = True
+                    if results[i]['tier'] != 'model':
+                        results[i].update(label="Error", tier='vector')
+        else:
+            errors_total.inc('vector_unavailable')
+            for i in leftovers:
+                results[i]['degraded'] = True
+                if results[i]['tier'] != 'model':
+                    results[i]['label'] = "System Not Initialized"
+
+    return results
+
+# --- Startup ---
+startup_stats = {'import_seconds': None, 'warmup_seconds': None}
+
+def cold_start_seconds():
+    """Import to the end of the latest first load of a heavy resource,
+    whether warmup() or a request triggered it; None before any load."""
+    loaded = [r.loaded_at for r in (vector_store, tfidf) if r.loaded]
+    return max(loaded) - IMPORT_STARTED if loaded else None
+
+def warmup(run_inference=True):
+    """Load the heavy resources now instead of on the first request.
+
+    With ``run_inference`` a dummy email is also pushed through the model
+    and the vector search, so lazy initialisation inside torch and Chroma is
+    done before traffic arrives.
+    """
+    start = time.perf_counter()
+    vector_store.get()
+    tfidf.get()
+    if run_inference:
+        if vector_ready():
+            _vector_batch(["warmup"])
+        if tfidf.get().model is not None:
+            _warm_tfidf(tfidf.get())
+    startup_stats['warmup_seconds'] = time.perf_counter() - start
+    print(f"Warmup finished in {startup_stats['warmup_seconds']:.2f}s "
+          f"(ready {cold_start_seconds():.2f}s after import).")
+
+def startup_metrics():
+    return dict(startup_stats, cold_start_seconds=cold_start_seconds(),
+                resources={r.name: r.stats() for r in (vector_store, tfidf)})
+
+def _startup_phases():
+    phases = dict(startup_stats, cold_start_seconds=cold_start_seconds())
+    return {(name[:-len('_seconds')],): value for name, value in phases.items() if value is not None}
+
+def _tier_decisions():
+    with tier_counts_lock:
+        return {(tier,): n for tier, n in tier_counts.items()}
+
+metrics_registry.callback('email_tier_decisions_total', 'Emails decided by each cascade tier (cache hits as "cache").',
+                          'counter', _tier_decisions, ['tier'])
+metrics_registry.callback('result_cache_hits_total', 'Emails answered from the result cache.', 'counter',
+                          lambda: result_cache.stats()['hits'])
+metrics_registry.callback('result_cache_misses_total', 'Emails not found in the result cache.', 'counter',
+                          lambda: result_cache.stats()['misses'])
+metrics_registry.callback('result_cache_evictions_total', 'Least recently used entries evicted.', 'counter',
+                          lambda: result_cache.stats()['evictions'])
+metrics_registry.callback('result_cache_invalidations_total', 'Times the cache was emptied for new artifacts.',
+                          'counter', lambda: result_cache.stats()['invalidations'])
+metrics_registry.callback('result_cache_entries', 'Entries in the result cache.', 'gauge',
+                          lambda: result_cache.stats()['size'])
+metrics_registry.callback('artifact_reloads_total', 'New model or index versions swapped in.', 'counter',
+                          lambda: {('model',): tfidf.reloads, ('index',): vector_store.reloads}, ['artifact'])
+metrics_registry.callback('vector_batches_total', 'Micro-batches sent to the vector store.', 'counter',
+                          lambda: vector_batcher.stats()['batches'])
+metrics_registry.callback('vector_batch_items_total', 'Emails sent to the vector store in micro-batches.', 'counter',
+                          lambda: vector_batcher.stats()['items'])
+metrics_registry.callback('vector_batch_queue_depth', 'Requests waiting for the next micro-batch.', 'gauge',
+                          lambda: vector_batcher.stats()['queue_depth'])
+metrics_registry.callback('app_startup_seconds', 'Seconds spent on import, warmup and import-to-first-ready (cold_start).',
+                          'gauge', _startup_phases, ['phase'])
+
+@app.cli.command('warmup')
+def warmup_command():
+    """Load and exercise the models, then report cold-start time."""
+    warmup()
 
 # --- Routes ---
 
@@ -67,38 +508,120 @@ def index():
     
     if request.method == 'POST':
         email_text = request.form['email']
-        
-        # 1. Try Heuristic First
-        heuristic_pred = auto_label(email_text)
-        
-        if heuristic_pred != 'General':
-            prediction = heuristic_pred
+        result = classify_emails([email_text])[0]
+        prediction = result['label']
+        if result['tier'] == 'heuristic':
             print(f"Heuristic Prediction: {prediction}")
-        elif collection:
-            # 2. Vector Search (Semantic Classification)
-            try:
-                results = collection.query(
-                    query_texts=[email_text],
-                    n_results=5
-                )
-                
-                # Get categories of nearest neighbors
-                metadatas = results['metadatas'][0]
-                categories = [m['category'] for m in metadatas]
-                
-                # Majority Vote
-                if categories:
-                    prediction = max(set(categories), key=categories.count)
-                    print(f"Vector DB Prediction: {prediction} (Neighbors: {categories})")
-                else:
-                    prediction = "General"
-            except Exception as e:
-                print(f"Vector DB Error: {e}")
-                prediction = "Error"
-        else:
-            prediction = "System Not Initialized"
+        elif result['tier'] == 'model':
+            print(f"Model Prediction: {prediction} (Confidence: {result['confidence']:.2f})")
+        elif result['tier'] == 'duplicate':
+            print(f"Near-Duplicate Prediction: {prediction}")
+        elif result['tier'] == 'prototype':
+            print(f"Prototype Prediction: {prediction}")
+        elif result['tier'] == 'vector' and prediction != "Error":
+            print(f"Vector DB Prediction: {prediction} (Neighbors: {result['neighbors']})")
             
-    return render_template('index.html', prediction=prediction, email_text=email_text, username=current_user.username)
+    with stage_seconds.time('render'):
+        return render_template('index.html', prediction=prediction, email_text=email_text, username=current_user.username)
+
+# Larger batches are refused with 413 rather than tying up a worker; 0 lifts
+# the limit.
+app.config['MAX_BATCH_EMAILS'] = int(os.environ.get('MAX_BATCH_EMAILS', '1000'))
+
+@app.route('/api/classify', methods=['POST'])
+@login_required
+def api_classify():
+    """Classify many emails in one request.
+
+    Expects ``{"emails": ["...", ...]}``, optionally with ``"filters"``: a
+    ChromaDB ``where`` clause on the stored header metadata (``subject``,
+    ``from``, ``to``, ``date``, ``date_ts``) that restricts which indexed
+    emails can be neighbors. Returns
+    ``{"results": [{"label", "neighbors", "confidence", "tier"}, ...]}`` in
+    input order, or 413 for more than ``MAX_BATCH_EMAILS`` emails.
+    """
+    payload = request.get_json(silent=True) or {}
+    emails = payload.get('emails')
+    if not isinstance(emails, list) or not all(isinstance(e, str) for e in emails):
+        return jsonify({'error': 'Expected a JSON body like {"emails": ["..."]}'}), 400
+    limit = app.config['MAX_BATCH_EMAILS']
+    if limit and len(emails) > limit:
+        return jsonify({'error': f'At most {limit} emails per request'}), 413
+    filters = payload.get('filters')
+    if filters is not None and not isinstance(filters, dict):
+        return jsonify({'error': '"filters" must be a JSON object'}), 400
+    return jsonify({'results': classify_emails(emails, filters)})
+
+@app.route('/api/stats')
+@login_required
+def api_stats():
+    """How many emails each cascade tier has decided since startup."""
+    return jsonify({'tiers': tier_hit_rates(), 'cache': result_cache.stats(), 'vector_batcher': vector_batcher.stats(),
+                    'startup': startup_metrics()})
+
+@app.route('/status')
+def status():
+    """Artifact versions this worker is serving: the model bundle and vector
+    index version swapped in, the version stamped on disk, any reload in
+    progress and old versions still draining."""
+    return jsonify({'pid': os.getpid(), 'model': tfidf.stats(), 'index': vector_store.stats()})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint: stage and request latency histograms, tier
+    decisions, errors, result cache and micro-batcher counters."""
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return 'Unauthorized', 401
+    return metrics_registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    profiler.start(request.headers)
+    artifact_watcher.check()
+
+@app.teardown_request
+def finish_request_profile(exc):
+    profiler.stop(request.endpoint or 'unknown')
+
+def _profiler_admin():
+    token = app.config['PROFILE_TOKEN']
+    return bool(token) and request.headers.get('Authorization') == f"Bearer {token}"
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+def profiler_admin():
+    """Show the request profiler's state, or change its sampling rate.
+
+    ``POST {"sample_percent": 5}`` profiles 5% of the requests this worker
+    serves; 0 turns sampling off. Needs ``Authorization: Bearer
+    <PROFILE_TOKEN>``.
+    """
+    if not _profiler_admin():
+        return 'Forbidden', 403
+    if request.method == 'POST':
+        percent = (request.get_json(silent=True) or {}).get('sample_percent')
+        if isinstance(percent, bool) or not isinstance(percent, (int, float)) or not 0 <= percent <= 100:
+            return jsonify({'error': '"sample_percent" must be a number between 0 and 100'}), 400
+        profiler.sample_percent = float(percent)
+    return jsonify(profiler.stats())
+
+@app.route('/admin/profiler/collapsed')
+def profiler_collapsed():
+    """Saved stack samples merged into one collapsed-stack file
+    (``?route=index`` for one endpoint), ready for flamegraph.pl or
+    speedscope."""
+    if not _profiler_admin():
+        return 'Forbidden', 403
+    return aggregate(profiler.directory, request.args.get('route')), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        request_seconds.observe(time.perf_counter() - started, request.endpoint or 'unknown', request.method,
+                                response.status_code)
+    return response
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -140,6 +663,18 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
+startup_stats['import_seconds'] = time.perf_counter() - IMPORT_STARTED
+
+# APP_PRELOAD=1 loads the models while the module is imported, so a pre-fork
+# server (e.g. `gunicorn --preload app:app`) loads them once in the parent and
+# the workers share the pages copy-on-write. No inference runs before the
+# fork, since torch thread pools do not survive it. APP_WARMUP=1 also runs a
+# dummy encode and query; use it when each worker imports the app itself.
+if os.environ.get('APP_WARMUP') == '1':
+    warmup()
+elif os.environ.get('APP_PRELOAD') == '1':
+    warmup(run_inference=False)
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all() # Create tables if they don't exist
@@ -0,0 +1,88 @@
+import argparse
+import os
+import time
+
+import chromadb
+import numpy as np
+from chromadb.utils import embedding_functions
+
+from knn_engine import KNN_DIRNAME, NumpyKNN
+from prototypes import PROTOTYPES_FILE, Prototypes
+from version_stamps import current_index_dir
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+
+def benchmark(n_queries=200, k=5, directory=None, seed=42, margin=0.05):
+    path = current_index_dir()
+    chroma_client = chromadb.PersistentClient(path=path)
+    sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
+    collection = chroma_client.get_collection(name="email_collection", embedding_function=sentence_transformer_ef)
+    knn = NumpyKNN(directory or os.path.join(path, KNN_DIRNAME))
+    ids = knn.ids()
+    print(f"Chroma collection: {collection.count()} vectors, NumPy index: {len(knn)} vectors ({knn.meta['dtype']})")
+
+    # Query with stored embeddings so both paths time only the search.
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(knn), size=min(n_queries, len(knn)), replace=False)
+    query_ids = [ids[i].decode() for i in sample]
+    stored = collection.get(ids=query_ids, include=['embeddings'])
+    by_id = dict(zip(stored['ids'], stored['embeddings']))
+    queries = np.asarray([by_id[i] for i in query_ids], dtype=np.float32)
+
+    prototypes_path = os.path.join(path, PROTOTYPES_FILE)
+    prototypes = Prototypes(prototypes_path) if os.path.exists(prototypes_path) else None
+    chroma_times, numpy_times, prototype_times = [], [], []
+    recalls, label_agreement, prototype_agreement, margins = [], [], [], []
+    for q in queries:
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[q.tolist()], n_results=k)
+        chroma_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        indices, _ = knn.search(q, k)
+        numpy_times.append(time.perf_counter() - start)
+
+        chroma_ids = set(result['ids'][0])
+        numpy_ids = {ids[i].decode() for i in indices[0]}
+        recalls.append(len(chroma_ids & numpy_ids) / max(len(chroma_ids), 1))
+        chroma_cats = [m['category'] for m in result['metadatas'][0]]
+        numpy_cats = [knn.categories[c] for c in knn.labels[indices[0]]]
+        label_agreement.append(sorted(chroma_cats) == sorted(numpy_cats))
+
+        if prototypes is not None:
+            start = time.perf_counter()
+            labels, margin_q = prototypes.classify(q)
+            prototype_times.append(time.perf_counter() - start)
+            prototype_agreement.append(labels[0] == max(set(chroma_cats), key=chroma_cats.count))
+            margins.append(margin_q[0])
+
+    start = time.perf_counter()
+    knn.search(queries, k)
+    batch_seconds = time.perf_counter() - start
+
+    print(f"\n{'Backend':<8} | {'p50 ms':>8} | {'p95 ms':>8} | {'mean ms':>8}")
+    print("-" * 42)
+    rows = [('chroma', chroma_times), ('numpy', numpy_times)] + ([('proto', prototype_times)] if prototype_times else [])
+    for name, times in rows:
+        print(f"{name:<8} | {percentile_ms(times, 50):>8.2f} | {percentile_ms(times, 95):>8.2f} | {np.mean(times) * 1000:>8.2f}")
+    print(f"\nNumPy batched: {len(queries)} queries in {batch_seconds * 1000:.1f} ms")
+    print(f"Recall@{k} of NumPy vs Chroma: {np.mean(recalls):.4f}")
+    print(f"Same neighbor categories: {np.mean(label_agreement):.2%}")
+    if prototypes is not None:
+        sure = np.array(margins) >= margin
+        print(f"Prototype label = kNN majority vote: {np.mean(prototype_agreement):.2%} "
+              f"({np.mean(np.array(prototype_agreement)[sure]) if sure.any() else float('nan'):.2%} above margin {margin})")
+        print(f"Queries falling back to kNN at margin {margin}: {1 - sure.mean():.2%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the NumPy kNN backend and the category prototypes with ChromaDB.")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--dir', help="kNN export to compare (default: the published index version's)")
+    parser.add_argument('--margin', type=float, default=0.05, help="PROTOTYPE_MARGIN to evaluate")
+    args = parser.parse_args()
+    benchmark(args.queries, args.k, args.dir, margin=args.margin)
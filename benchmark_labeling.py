@@ -0,0 +1,59 @@
+import argparse
+import os
+import time
+
+import labeling
+from corpus_cache import load_corpus
+from labeling import CATEGORY_KEYWORDS, DEFAULT_CATEGORY, auto_label, label_batch
+
+
+def legacy_auto_label(text):
+    """The original per-keyword substring loop, kept here as the reference."""
+    text = text.lower()
+    for category, keywords in CATEGORY_KEYWORDS:
+        for word in keywords:
+            if word in text:
+                return category
+    return DEFAULT_CATEGORY
+
+
+def benchmark(csv_path='emails.csv', nrows=None, repeat=3):
+    if not os.path.exists(csv_path):
+        print(f"Error: {csv_path} not found.")
+        return
+
+    print("Loading emails...")
+    texts = load_corpus(['parsed_content'], nrows=nrows, csv_path=csv_path)['parsed_content'].tolist()
+    total_chars = sum(len(t) for t in texts)
+    print(f"Loaded {len(texts)} emails ({total_chars / 1e6:.1f}M characters).")
+    matcher = 'Aho-Corasick' if labeling.ahocorasick is not None else 'substring fallback (pip install pyahocorasick)'
+    print(f"Matcher: {matcher}")
+
+    timings = {}
+    results = {}
+    for name, fn in [('legacy loop', lambda: [legacy_auto_label(t) for t in texts]),
+                     ('compiled matcher', lambda: [auto_label(t) for t in texts]),
+                     ('label_batch', lambda: label_batch(texts))]:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results[name] = fn()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+
+    mismatches = sum(a != b for a, b in zip(results['legacy loop'], results['compiled matcher']))
+    print(f"\n{'Implementation':<20} | {'Seconds':>8} | {'Emails/sec':>12}")
+    print("-" * 48)
+    for name, seconds in timings.items():
+        print(f"{name:<20} | {seconds:>8.3f} | {len(texts) / seconds:>12,.0f}")
+    print(f"\nSpeedup: {timings['legacy loop'] / timings['compiled matcher']:.2f}x")
+    print(f"Label mismatches vs legacy loop: {mismatches}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the keyword labeler against the legacy loop.")
+    parser.add_argument('--csv', default='emails.csv')
+    parser.add_argument('--nrows', type=int, default=None, help="Limit rows read (default: full corpus)")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.csv, args.nrows, args.repeat)
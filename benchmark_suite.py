@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from corpus_cache import load_corpus
+
+ENGINES = ['heuristic', 'model', 'vector', 'cascade']
+# Emails are replayed grouped by body length in characters.
+LENGTH_BINS = [('short', 0, 500), ('medium', 500, 2000), ('long', 2000, None)]
+BATCH_SIZES = [1, 8, 32, 128]
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+
+def _engine_fn(engine):
+    """The function the app runs for ``engine``, or None when it is not set up."""
+    if engine == 'heuristic':
+        from labeling import label_batch
+        return label_batch
+    import app
+
+    if engine == 'model':
+        resources = app.tfidf.get()
+        if resources.model is None:
+            return None
+        return lambda texts: resources.model.predict_proba(resources.vectorizer.transform(texts))
+    if engine == 'vector':
+        # What the micro-batcher calls: embedding plus kNN or prototypes,
+        # following VECTOR_BACKEND and VECTOR_MODE.
+        return app._vector_batch if app.vector_ready() else None
+    # The whole cascade, minus the result cache, which would turn a replay
+    # into cache hits.
+    return app.run_cascade
+
+
+def run_engine(engine, texts_by_length, batch_sizes, emails_per_case):
+    """Replay every length bin at every batch size through one engine.
+
+    Runs in its own process, so the peak RSS reported is this engine's.
+    """
+    fn = _engine_fn(engine)
+    if fn is None:
+        return [], f"{engine} is not available (run train_model.py / init_vectordb.py)"
+    fn(texts_by_length[next(iter(texts_by_length))][:1])  # load lazily initialised resources
+    results = []
+    for length, texts in texts_by_length.items():
+        for batch_size in batch_sizes:
+            n_batches = max(3, emails_per_case // batch_size)
+            latencies = []
+            for b in range(n_batches):
+                batch = [texts[(b * batch_size + i) % len(texts)] for i in range(batch_size)]
+                began = time.perf_counter()
+                fn(batch)
+                latencies.append(time.perf_counter() - began)
+            seconds = sum(latencies)
+            results.append({
+                'engine': engine, 'length': length, 'batch_size': batch_size, 'emails': n_batches * batch_size,
+                'seconds': seconds, 'emails_per_second': n_batches * batch_size / seconds,
+                'p50_ms': percentile_ms(latencies, 50), 'p95_ms': percentile_ms(latencies, 95),
+                'p99_ms': percentile_ms(latencies, 99),
+                # ru_maxrss is in kilobytes on Linux
+                'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            })
+            print(f"{engine:<9} {length:<6} batch {batch_size:>4}: {results[-1]['emails_per_second']:>10,.0f} emails/sec, "
+                  f"p50 {results[-1]['p50_ms']:.2f} ms, p99 {results[-1]['p99_ms']:.2f} ms")
+    return results, None
+
+
+def sample_by_length(csv_path, rows, per_bin, seed):
+    texts = load_corpus(['parsed_content'], nrows=rows, csv_path=csv_path)['parsed_content'].tolist()
+    lengths = np.array([len(t) for t in texts])
+    rng = np.random.default_rng(seed)
+    texts_by_length = {}
+    for name, low, high in LENGTH_BINS:
+        members = np.flatnonzero((lengths >= low) & (lengths < (high or np.inf)))
+        if len(members):
+            chosen = rng.choice(members, size=min(per_bin, len(members)), replace=False)
+            texts_by_length[name] = [texts[i] for i in chosen]
+    return texts_by_length
+
+
+def compare(results, baseline, tolerance):
+    """Cases slower than the baseline by more than ``tolerance`` (a fraction)
+    in throughput or p95 latency."""
+    previous = {(r['engine'], r['length'], r['batch_size']): r for r in baseline['results']}
+    regressions = []
+    print(f"\n{'Case':<28} | {'emails/sec':>21} | {'p95 ms':>19}")
+    print("-" * 76)
+    for r in results:
+        old = previous.get((r['engine'], r['length'], r['batch_size']))
+        if old is None:
+            continue
+        throughput = r['emails_per_second'] / old['emails_per_second'] - 1
+        p95 = r['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0.0
+        slower = throughput < -tolerance or p95 > tolerance
+        case = f"{r['engine']} {r['length']} x{r['batch_size']}"
+        print(f"{case:<28} | {r['emails_per_second']:>12,.0f} {throughput:>+8.1%} | {r['p95_ms']:>10.2f} {p95:>+8.1%}"
+              f"{'  REGRESSION' if slower else ''}")
+        if slower:
+            regressions.append(case)
+    return regressions
+
+
+def benchmark(csv_path='emails.csv', rows=20000, per_bin=256, engines=ENGINES, batch_sizes=BATCH_SIZES,
+              emails_per_case=256, output='benchmark_results.json', baseline_path=None, tolerance=0.1, seed=42):
+    """Replay sampled emails through each engine and write the results as JSON.
+
+    Each engine runs in a fresh process, one after another, so their memory
+    peaks and warm caches do not mix. Returns the number of regressions
+    against ``baseline_path`` (0 without one).
+    """
+    if not os.path.exists(csv_path):
+        print(f"Error: {csv_path} not found.")
+        return 0
+    from version_stamps import INDEX_STAMP, MODEL_STAMP, read_stamp
+
+    texts_by_length = sample_by_length(csv_path, rows, per_bin, seed)
+    print("Replaying " + ', '.join(f"{len(t)} {name}" for name, t in texts_by_length.items()) + " emails")
+
+    results, skipped = [], {}
+    for engine in engines:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            engine_results, error = pool.submit(run_engine, engine, texts_by_length, batch_sizes, emails_per_case).result()
+        results.extend(engine_results)
+        if error:
+            print(error)
+            skipped[engine] = error
+
+    report = {
+        'meta': {'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'python': platform.python_version(),
+                 'platform': platform.platform(), 'cpus': os.cpu_count(), 'csv': csv_path, 'seed': seed,
+                 'model_version': read_stamp(MODEL_STAMP), 'index_version': read_stamp(INDEX_STAMP),
+                 'vector_backend': os.environ.get('VECTOR_BACKEND', 'chroma'),
+                 'vector_mode': os.environ.get('VECTOR_MODE', 'knn'), 'skipped': skipped},
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if not baseline_path:
+        return 0
+    with open(baseline_path) as f:
+        regressions = compare(results, json.load(f), tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regressions beyond {tolerance:.0%} against {baseline_path}")
+    else:
+        print(f"\nNo regressions beyond {tolerance:.0%} against {baseline_path}")
+    return len(regressions)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay emails.csv through each classifier engine and the full cascade.")
+    parser.add_argument('--csv', default='emails.csv')
+    parser.add_argument('--rows', type=int, default=20000, help="Rows of the corpus to sample from")
+    parser.add_argument('--per-bin', type=int, default=256, help="Emails sampled per length bin")
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--batch-sizes', default=','.join(str(b) for b in BATCH_SIZES))
+    parser.add_argument('--emails-per-case', type=int, default=256, help="Emails replayed per engine/length/batch size")
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help="Earlier results to compare against; exits 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed slowdown as a fraction (default 0.1)")
+    args = parser.parse_args()
+    regressions = benchmark(args.csv, args.rows, args.per_bin, args.engines.split(','),
+                            [int(b) for b in args.batch_sizes.split(',')], args.emails_per_case, args.output,
+                            args.baseline, args.tolerance)
+    sys.exit(1 if regressions else 0)
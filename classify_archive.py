@@ -0,0 +1,274 @@
+import argparse
+import email
+import json
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import pandas as pd
+
+from email_parsing import parse_raw_message
+
+# Set in each worker by _init_worker; the parent never imports the app, so
+# it stays light and torch is first loaded after the fork.
+cascade = None
+
+
+def detect_format(path):
+    if os.path.isdir(path):
+        return 'maildir'
+    if path.lower().endswith('.csv'):
+        return 'csv'
+    return 'mbox'
+
+
+def read_mbox(path, skip=0):
+    """Yield (message number, raw bytes) from an mbox file, streaming.
+
+    A line starting with "From " begins a new message, as in Python's
+    mailbox module. Skipped messages are scanned but not kept.
+    """
+    number = -1
+    lines = []
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.startswith(b'From '):
+                if number >= skip:
+                    yield str(number), b''.join(lines)
+                number += 1
+                lines = []
+            if number >= skip:
+                lines.append(line)
+    if number >= skip:
+        yield str(number), b''.join(lines)
+
+
+def read_maildir(path, skip=0):
+    """Yield (relative path, raw bytes) for every message file under ``path``.
+
+    Works for Maildir folders (cur/new) and for plain trees of one message
+    per file, like the Enron maildir. Files are visited in sorted order so a
+    resumed run sees them in the same order.
+    """
+    number = 0
+    for root, dirs, files in os.walk(path):
+        if 'cur' in dirs:
+            # Maildir's tmp/ holds messages still being delivered.
+            dirs[:] = [d for d in dirs if d != 'tmp']
+        dirs.sort()
+        for name in sorted(files):
+            if name.startswith('.'):
+                continue
+            number += 1
+            if number <= skip:
+                continue
+            file_path = os.path.join(root, name)
+            with open(file_path, 'rb') as f:
+                yield os.path.relpath(file_path, path), f.read()
+
+
+def read_csv(path, skip=0, chunk_size=10000):
+    """Yield (id, raw message) from a CSV like emails.csv. The id is the
+    ``file`` column when there is one, otherwise the row number."""
+    reader = pd.read_csv(path, usecols=lambda c: c in ('file', 'message'), chunksize=chunk_size,
+                         skiprows=range(1, skip + 1))
+    row = skip
+    for chunk in reader:
+        ids = chunk['file'] if 'file' in chunk else range(row, row + len(chunk))
+        for message_id, raw in zip(ids, chunk['message']):
+            yield str(message_id), raw if isinstance(raw, str) else ''
+        row += len(chunk)
+
+
+READERS = {'mbox': read_mbox, 'maildir': read_maildir, 'csv': read_csv}
+
+
+def message_text(raw):
+    """Body text to classify. CSV rows are parsed like the rest of the
+    pipeline; mbox and Maildir messages give their first text/plain part,
+    with the transfer encoding and charset decoded."""
+    if isinstance(raw, str):
+        return parse_raw_message(raw)
+    message = email.message_from_bytes(raw)
+    part = next((p for p in message.walk() if p.get_content_type() == 'text/plain' and not p.get_filename()), None)
+    if part is None:
+        return ''
+    payload = part.get_payload(decode=True) or b''
+    try:
+        return payload.decode(part.get_content_charset() or 'utf-8', 'replace').strip()
+    except LookupError:
+        return payload.decode('utf-8', 'replace').strip()
+
+
+def _init_worker(env):
+    global cascade
+    os.environ.update(env)
+    import app as cascade
+
+
+def classify_chunk(items):
+    """Run one chunk of (id, raw) pairs through the app's cascade.
+
+    Returns the result records and the seconds each stage took on this
+    chunk, read from the app's own stage histograms.
+    """
+    started = time.perf_counter()
+    texts = [message_text(raw) for _, raw in items]
+    parse_seconds = time.perf_counter() - started
+    before = cascade.stage_seconds.totals()
+    results = cascade.classify_emails(texts)
+    seconds = {'parse': parse_seconds}
+    for (stage,), (total, _) in cascade.stage_seconds.totals().items():
+        spent = total - before.get((stage,), (0.0, 0))[0]
+        if spent > 0:
+            seconds[stage] = spent
+    records = [{'id': message_id, 'label': r['label'], 'tier': r['tier'], 'confidence': r['confidence'],
+                'neighbors': r['neighbors'], 'cached': r['cached']} for (message_id, _), r in zip(items, results)]
+    return records, seconds
+
+
+def _chunks(messages, size):
+    chunk = []
+    for message in messages:
+        chunk.append(message)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def completed_records(output_path):
+    """Number of complete records in an earlier output. A line cut short by
+    a crash is truncated away so the run can append after it."""
+    if not os.path.exists(output_path):
+        return 0
+    count = 0
+    good_bytes = 0
+    with open(output_path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            count += 1
+            good_bytes += len(line)
+    if good_bytes != os.path.getsize(output_path):
+        with open(output_path, 'r+b') as f:
+            f.truncate(good_bytes)
+    return count
+
+
+def trim_timing(timing_path, records):
+    """Drop the timing rows of chunks beyond the first ``records`` messages,
+    so a resumed run does not log them twice."""
+    if not os.path.exists(timing_path):
+        return
+    good_bytes = 0
+    with open(timing_path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            row = json.loads(line)
+            if row['first'] + row['messages'] > records:
+                break
+            good_bytes += len(line)
+    with open(timing_path, 'r+b') as f:
+        f.truncate(good_bytes)
+
+
+def classify_archive(input_path, output_path, input_format=None, workers=None, batch_size=256, resume=False,
+                     limit=None, tiers=None):
+    """Classify every message in an mbox file, Maildir tree or CSV into JSONL.
+
+    Messages are read in order and sent in ``batch_size`` chunks to a pool
+    of ``workers`` processes, each running the app's cascade on whole
+    chunks. At most two chunks per worker are in flight, so memory stays
+    flat on any archive size. Results are written in input order, one JSON
+    object per message; per-chunk stage timings go to
+    ``<output>.timing.jsonl``. With ``resume`` the messages already in the
+    output are skipped, and count towards ``limit``. Returns the summary
+    stats.
+    """
+    input_format = input_format or detect_format(input_path)
+    workers = workers or os.cpu_count() or 1
+    timing_path = output_path + '.timing.jsonl'
+    skip = completed_records(output_path) if resume else 0
+    if resume:
+        trim_timing(timing_path, skip)
+    if skip:
+        print(f"Resuming after {skip} messages already in {output_path}.")
+
+    env = {
+        # One process per core: keep torch and the tokenizer to their share.
+        'OMP_NUM_THREADS': os.environ.get('OMP_NUM_THREADS', str(max(1, (os.cpu_count() or 1) // workers))),
+        'TOKENIZERS_PARALLELISM': 'false',
+        # Each worker sends its whole chunk to the vector store itself.
+        'VECTOR_BATCH_WINDOW_MS': '0',
+    }
+    if tiers:
+        env['CASCADE_TIERS'] = tiers
+
+    messages = READERS[input_format](input_path, skip=skip)
+    if limit is not None:
+        messages = islice(messages, max(0, limit - skip))
+
+    mode = 'a' if resume else 'w'
+    tier_counts = Counter()
+    stage_totals = Counter()
+    done = 0
+    started = last_report = time.perf_counter()
+    with open(output_path, mode) as out, open(timing_path, mode) as timing_out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(env,)) as pool:
+        pending = deque()
+
+        def write_oldest():
+            nonlocal done
+            records, seconds = pending.popleft().result()
+            out.write(''.join(json.dumps(r) + '\n' for r in records))
+            out.flush()
+            counts = Counter('cache' if r['cached'] else r['tier'] for r in records)
+            timing_out.write(json.dumps({'first': skip + done, 'messages': len(records), 'seconds': seconds,
+                                         'tiers': counts}) + '\n')
+            done += len(records)
+            tier_counts.update(counts)
+            stage_totals.update(seconds)
+
+        for chunk in _chunks(messages, batch_size):
+            pending.append(pool.submit(classify_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                write_oldest()
+            now = time.perf_counter()
+            if now - last_report >= 10:
+                print(f"{skip + done} messages classified, {done / (now - started):.0f} msgs/sec")
+                last_report = now
+        while pending:
+            write_oldest()
+
+    elapsed = time.perf_counter() - started
+    stats = {'messages': done, 'skipped': skip, 'seconds': elapsed,
+             'messages_per_second': done / elapsed if elapsed else 0.0,
+             'tiers': dict(tier_counts), 'stage_seconds': dict(stage_totals)}
+    print(f"Classified {done} messages in {elapsed:.1f}s ({stats['messages_per_second']:.0f} msgs/sec) with {workers} workers.")
+    for tier, n in tier_counts.most_common():
+        print(f"  {tier:<10} {n:>9} ({n / done:.1%})")
+    print("Stage seconds, summed over workers: " + ', '.join(f"{s} {t:.1f}" for s, t in stage_totals.most_common()))
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify an mbox file, a Maildir tree or a CSV of emails into JSONL.")
+    parser.add_argument('input', help="mbox file, Maildir directory or CSV with a 'message' column")
+    parser.add_argument('-o', '--output', required=True, help="JSONL file, one result per message")
+    parser.add_argument('--format', choices=sorted(READERS), default=None, help="Input format (default: guessed from the path)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--batch-size', type=int, default=256, help="Messages per chunk sent to a worker")
+    parser.add_argument('--resume', action='store_true', help="Skip messages already in the output and append")
+    parser.add_argument('--limit', type=int, default=None, help="Stop once the output holds this many messages, resumed ones included")
+    parser.add_argument('--tiers', default=None, help="Cascade tiers, e.g. heuristic,model (default: CASCADE_TIERS or all)")
+    args = parser.parse_args()
+    if args.resume and not os.path.exists(args.output):
+        print(f"Nothing to resume in {args.output}; starting from the beginning.", file=sys.stderr)
+    classify_archive(args.input, args.output, args.format, args.workers, args.batch_size, args.resume, args.limit,
+                     args.tiers)
@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from email_parsing import PARSER_VERSION, parse_messages
+from index_manifest import content_hash, file_signature
+from labeling import LABELER_VERSION, label_batch
+from near_duplicates import simhash
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+CACHE_DIR = "corpus_cache"
+COLUMNS = ['row', 'parsed_content', 'subject', 'from', 'to', 'date', 'date_ts', 'category', 'content_hash', 'simhash']
+
+
+def _paths(cache_dir):
+    return os.path.join(cache_dir, 'corpus.parquet'), os.path.join(cache_dir, 'meta.json')
+
+
+def cache_key(csv_path):
+    """Everything that changes the cached output."""
+    return {
+        'csv': os.path.abspath(csv_path),
+        'signature': file_signature(csv_path),
+        'parser_version': PARSER_VERSION,
+        'labeler_version': LABELER_VERSION,
+        'columns': COLUMNS,
+    }
+
+
+def is_fresh(csv_path='emails.csv', cache_dir=CACHE_DIR):
+    data_path, meta_path = _paths(cache_dir)
+    if not os.path.exists(data_path) or not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        return json.load(f).get('key') == cache_key(csv_path)
+
+
+def prepare_chunk(chunk):
+    """Parse, label and hash a chunk of raw CSV rows."""
+    parsed = parse_messages(chunk['message'])
+    parsed['category'] = label_batch(parsed['parsed_content']).values
+    parsed['content_hash'] = [content_hash(text) for text in parsed['parsed_content']]
+    # Nullable: a body without words has no signature.
+    parsed['simhash'] = pd.array([simhash(text) for text in parsed['parsed_content']], dtype='Int64')
+    parsed.insert(0, 'row', chunk.index.to_numpy())
+    return parsed[COLUMNS]
+
+
+def build_chunks(csv_path='emails.csv', cache_dir=CACHE_DIR, chunk_size=20000, workers=None):
+    """Parse the whole CSV once into a Parquet file, one row group per chunk,
+    yielding each prepared chunk as soon as it is written.
+
+    Chunks are parsed in a process pool with a bounded number in flight, and
+    written in file order, so memory stays flat however large the CSV is.
+    The cache is only published once every chunk is written; a consumer
+    that stops early leaves the old cache (or none) in place.
+    """
+    if pq is None:
+        raise RuntimeError("pyarrow is required for the corpus cache (pip install pyarrow)")
+    os.makedirs(cache_dir, exist_ok=True)
+    data_path, meta_path = _paths(cache_dir)
+    tmp_path = data_path + '.tmp'
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    rows = 0
+    writer = None
+    pending = deque()
+    complete = False
+
+    def write_oldest():
+        nonlocal writer, rows
+        prepared = pending.popleft().result()
+        table = pa.Table.from_pandas(prepared, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(tmp_path, table.schema, compression='zstd')
+        writer.write_table(table)
+        rows += len(prepared)
+        print(f"Cached {rows} rows ({rows / (time.perf_counter() - start):,.0f} rows/sec)")
+        return prepared
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for chunk in pd.read_csv(csv_path, usecols=['message'], chunksize=chunk_size):
+                pending.append(pool.submit(prepare_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    yield write_oldest()
+            while pending:
+                yield write_oldest()
+        complete = True
+    finally:
+        if writer is not None:
+            writer.close()
+        if not complete and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if writer is None:
+        raise ValueError(f"{csv_path} has no rows")
+    os.replace(tmp_path, data_path)
+    with open(meta_path, 'w') as f:
+        json.dump({'key': cache_key(csv_path), 'rows': rows}, f)
+    print(f"Corpus cache written to {data_path} in {time.perf_counter() - start:.1f}s")
+
+
+def build_cache(csv_path='emails.csv', cache_dir=CACHE_DIR, chunk_size=20000, workers=None):
+    """Build the cache in one go; returns the number of rows."""
+    return sum(len(chunk) for chunk in build_chunks(csv_path, cache_dir, chunk_size, workers))
+
+
+def ensure_cache(csv_path='emails.csv', cache_dir=CACHE_DIR, workers=None):
+    """Build the cache if it is missing or stale. Returns False without pyarrow."""
+    if pq is None:
+        return False
+    if not is_fresh(csv_path, cache_dir):
+        print(f"Corpus cache is missing or stale; parsing {csv_path} once...")
+        build_cache(csv_path, cache_dir, workers=workers)
+    return True
+
+
+def iter_corpus(columns=None, batch_size=20000, start_row=0, max_rows=None, csv_path='emails.csv',
+                cache_dir=CACHE_DIR, workers=None):
+    """Yield DataFrames of parsed emails, indexed by CSV row number.
+
+    Reads only the requested columns from the cache. Without pyarrow it
+    falls back to parsing the CSV on the fly.
+    """
+    columns = [c for c in (columns or COLUMNS) if c != 'row']
+    remaining = max_rows
+    if pq is None:
+        reader = pd.read_csv(csv_path, usecols=['message'], chunksize=batch_size, nrows=max_rows,
+                             skiprows=range(1, start_row + 1))
+        offset = start_row
+        for chunk in reader:
+            chunk.index = chunk.index + offset
+            yield prepare_chunk(chunk).set_index('row')[columns]
+        return
+    if max_rows is None and not is_fresh(csv_path, cache_dir):
+        # A pass over the whole file hands chunks on while the cache is
+        # written, so the caller's work overlaps with parsing instead of
+        # waiting for it. A partial pass builds the whole cache first.
+        print(f"Corpus cache is missing or stale; parsing {csv_path} once...")
+        for prepared in build_chunks(csv_path, cache_dir, batch_size, workers):
+            df = prepared.set_index('row')
+            df = df[df.index >= start_row]
+            if len(df):
+                yield df[columns]
+        return
+    ensure_cache(csv_path, cache_dir, workers)
+
+    parquet = pq.ParquetFile(_paths(cache_dir)[0])
+    # Skip whole row groups before start_row without reading them.
+    groups = []
+    first = 0
+    for g in range(parquet.num_row_groups):
+        n = parquet.metadata.row_group(g).num_rows
+        if groups or first + n > start_row:
+            groups.append(g)
+        else:
+            first += n
+    skip = start_row - first
+    for batch in parquet.iter_batches(batch_size=batch_size, row_groups=groups, columns=['row'] + columns):
+        df = batch.to_pandas().set_index('row')
+        if skip:
+            df, skip = df.iloc[skip:], max(skip - len(df), 0)
+        if remaining is not None:
+            df = df.iloc[:remaining]
+            remaining -= len(df)
+        if len(df):
+            yield df
+        if remaining == 0:
+            return
+
+
+def load_corpus(columns=None, nrows=None, csv_path='emails.csv', cache_dir=CACHE_DIR):
+    """The first ``nrows`` parsed emails (all if None) as one DataFrame."""
+    frames = list(iter_corpus(columns, max_rows=nrows, csv_path=csv_path, cache_dir=cache_dir))
+    if not frames:
+        return pd.DataFrame(columns=[c for c in (columns or COLUMNS) if c != 'row'])
+    return pd.concat(frames)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse emails.csv once into the shared corpus cache.")
+    parser.add_argument('--csv', default='emails.csv')
+    parser.add_argument('--chunk-size', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="Rebuild even if the cache is fresh")
+    args = parser.parse_args()
+    if args.force or not is_fresh(args.csv):
+        build_cache(args.csv, chunk_size=args.chunk_size, workers=args.workers)
+    else:
+        print("Corpus cache is up to date.")
@@ -1,15 +1,11 @@
-import pandas as pd
-import pickle
 import os
-from train_model import auto_label, parse_raw_message
+from model_bundle import load_model
+from corpus_cache import load_corpus
 
 def test_model():
     print("--- Testing Model ---")
     try:
-        with open('model.pkl', 'rb') as f:
-            model = pickle.load(f)
-        with open('vectorizer.pkl', 'rb') as f:
-            vectorizer = pickle.load(f)
+        model, vectorizer = load_model()
         print("Model and vectorizer loaded successfully.")
     except Exception as e:
         print(f"Error loading model: {e}")
@@ -37,9 +33,7 @@ def check_data_distribution():
         return
 
     try:
-        df = pd.read_csv('emails.csv', nrows=5000)
-        df['parsed_content'] = df['message'].apply(parse_raw_message)
-        df['category'] = df['parsed_content'].apply(auto_label)
+        df = load_corpus(['category'], nrows=5000)
         print(df['category'].value_counts())
     except Exception as e:
         print(f"Error processing data: {e}")
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import sqlite3
+
+from near_duplicates import BLOCKS, find_near_duplicate, signature_blocks
+
+MANIFEST_PATH = os.path.join("chroma_db", "index_manifest.db")
+
+
+def content_hash(text):
+    """Stable document id for a parsed email body."""
+    return hashlib.sha1(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def file_signature(path):
+    """Size and mtime of a file, used to tell whether a resume is safe."""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+class IndexManifest:
+    """On-disk record of which documents are in the Chroma collection.
+
+    Every indexed document id is stored with the run that last saw it, so a
+    run can skip what is already embedded and delete what disappeared. The
+    number of CSV rows committed by the current run is kept alongside, so an
+    interrupted run can pick up from its last committed chunk.
+
+    Each document also keeps its SimHash signature, split into blocks for
+    lookup. A near-duplicate of a stored document is recorded with ``rep``
+    pointing at that document and is never added to the collection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        # WAL lets the app look up near-duplicates while a run is writing.
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, category TEXT, seen_run INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(docs)")}
+        for column, kind in [('simhash', 'INTEGER'), ('rep', 'TEXT')] + [(f"b{i}", 'INTEGER') for i in range(BLOCKS)]:
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE docs ADD COLUMN {column} {kind}")
+        for i in range(BLOCKS):
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS docs_b{i} ON docs (b{i}) WHERE rep IS NULL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS docs_rep ON docs (rep) WHERE rep IS NOT NULL")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get_state(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def clear(self):
+        self.conn.execute("DELETE FROM docs")
+        self.conn.execute("DELETE FROM state")
+        self.conn.commit()
+
+    def set_building(self, version):
+        """Record the index version the manifest describes until it is
+        published, or None once it is."""
+        self.set_state('building', version or '')
+        self.conn.commit()
+
+    def begin_run(self, signature, max_rows):
+        """Start a new run, or resume the last one if it did not finish.
+
+        Returns (run_id, rows already committed by that run).
+        """
+        run_id = int(self.get_state('run_id', 0))
+        resumable = (
+            self.get_state('finished', '1') == '0'
+            and self.get_state('signature') == signature
+            and self.get_state('max_rows') == str(max_rows)
+        )
+        if resumable:
+            return run_id, int(self.get_state('rows_done', 0))
+        run_id += 1
+        self.set_state('run_id', run_id)
+        self.set_state('signature', signature)
+        self.set_state('max_rows', max_rows)
+        self.set_state('rows_done', 0)
+        self.set_state('finished', 0)
+        self.conn.commit()
+        return run_id, 0
+
+    def _select_in(self, query, ids):
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            yield from self.conn.execute(query.format(','.join('?' * len(part))), part)
+
+    def known(self, ids):
+        """Map each already indexed id to (category, rep); rep is None for
+        documents stored in the collection."""
+        return {doc_id: (category, rep)
+                for doc_id, category, rep in self._select_in("SELECT id, category, rep FROM docs WHERE id IN ({})", ids)}
+
+    def near_duplicate(self, signature, max_distance):
+        """(id, category, distance) of the closest stored document, or None.
+
+        Sees documents added earlier in the current, uncommitted chunk.
+        """
+        return find_near_duplicate(self.conn, signature, max_distance)
+
+    def add(self, run_id, doc_id, category, signature, rep=None):
+        """Stage a new document; it is committed with the rest of its chunk."""
+        blocks = signature_blocks(signature) if signature is not None else [None] * BLOCKS
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO docs (id, category, seen_run, simhash, rep, {', '.join(f'b{i}' for i in range(BLOCKS))}) "
+            f"VALUES (?, ?, ?, ?, ?{', ?' * BLOCKS})",
+            (doc_id, category, run_id, signature, rep, *blocks),
+        )
+
+    def commit_chunk(self, run_id, ids, categories, rows_done):
+        """Record a chunk as indexed. Called only after Chroma accepted it."""
+        self.conn.executemany(
+            "INSERT INTO docs (id, category, seen_run) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET category = excluded.category, seen_run = excluded.seen_run",
+            [(doc_id, category, run_id) for doc_id, category in zip(ids, categories)],
+        )
+        self.set_state('rows_done', rows_done)
+        self.conn.commit()
+
+    def duplicate_counts(self, rep_ids):
+        """Number of near-duplicates collapsed into each of ``rep_ids``."""
+        counts = dict.fromkeys(rep_ids, 0)
+        counts.update(self._select_in("SELECT rep, COUNT(*) FROM docs WHERE rep IN ({}) GROUP BY rep", rep_ids))
+        return counts
+
+    def totals(self):
+        """(documents stored in the collection, near-duplicates collapsed)."""
+        stored, collapsed = self.conn.execute(
+            "SELECT COUNT(*) - COUNT(rep), COUNT(rep) FROM docs").fetchone()
+        return stored, collapsed
+
+    def stale(self, run_id):
+        """(id, rep) of documents not seen by the given run, i.e. removed from
+        the source."""
+        return self.conn.execute("SELECT id, rep FROM docs WHERE seen_run < ?", (run_id,)).fetchall()
+
+    def remove(self, ids):
+        """Forget ``ids``. Near-duplicates whose stored document is among them
+        are forgotten too, so they can be indexed afresh; returns their ids."""
+        ids = list(ids)
+        self.conn.executemany("DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in ids])
+        orphans = [row[0] for row in self.conn.execute(
+            "SELECT id FROM docs WHERE rep IS NOT NULL AND rep NOT IN (SELECT id FROM docs)")]
+        self.conn.executemany("DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in orphans])
+        self.conn.commit()
+        return orphans
+
+    def snapshot(self, path):
+        """Copy the committed manifest to ``path``, for lookups that must not
+        see a later run's changes."""
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        target = sqlite3.connect(tmp_path)
+        self.conn.backup(target)
+        # Readers open it read-only, which WAL mode does not allow.
+        target.execute("PRAGMA journal_mode=DELETE")
+        target.close()
+        os.replace(tmp_path, path)
+
+    def finish_run(self):
+        self.set_state('finished', 1)
+        self.conn.commit()
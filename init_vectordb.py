@@ -1,93 +1,346 @@
-import pandas as pd
 import chromadb
 from chromadb.utils import embedding_functions
+import argparse
+import json
 import os
+import shutil
+import time
+import pandas as pd
+from corpus_cache import iter_corpus
+from email_parsing import HEADER_FIELDS
+from index_manifest import MANIFEST_PATH, IndexManifest, file_signature
+from knn_engine import DTYPES, KNN_DIRNAME, export_embeddings
+from near_duplicates import BLOCKS, DUPLICATES_FILE, MAX_DISTANCE
+from prototypes import PROTOTYPES_FILE, build_prototypes
+from version_stamps import INDEX_STAMP, INDEX_VERSIONS_DIR, current_index_dir, new_version, read_stamp, write_stamp
 
-def parse_raw_message(raw_message):
-    lines = raw_message.split('\n')
-    body = []
-    reading_body = False
-    for line in lines:
-        if reading_body:
-            body.append(line)
-        elif line.strip() == "":
-            reading_body = True
-    return "\n".join(body).strip()
-
-def auto_label(text):
-    text = text.lower()
-    financial_keywords = ['budget', 'invoice', 'purchase', 'financial', 'report', 'quarterly', 'bank', 'money', 'expense', 'cost', 'payment', 'transaction', 'audit', 'billing']
-    urgent_keywords = ['urgent', 'immediate', 'emergency', 'deadline', 'breach', 'asap', 'critical', 'alert', 'warning', 'high priority', 'immediate action']
-    hr_keywords = ['hr', 'policies', 'performance', 'review', 'insurance', 'promotion', 'holiday', 'leave', 'benefits', 'hiring', 'salary', 'recruitment', 'onboarding', 'resignation', 'interview']
-    
-    for word in urgent_keywords:
-        if word in text:
-            return 'Urgent'
-    for word in financial_keywords:
-        if word in text:
-            return 'Financial'
-    for word in hr_keywords:
-        if word in text:
-            return 'HR'
-    return 'General'
-
-def init_db():
-    print("Initializing Vector Database...")
-    
-    # 1. Setup ChromaDB
-    chroma_client = chromadb.PersistentClient(path="chroma_db")
-    
-    # Use a lightweight model for embeddings
-    sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
-    
-    # Create or get collection
-    try:
-        collection = chroma_client.create_collection(name="email_collection", embedding_function=sentence_transformer_ef)
-    except Exception:
-        # If it exists, delete and recreate to start fresh
-        chroma_client.delete_collection(name="email_collection")
-        collection = chroma_client.create_collection(name="email_collection", embedding_function=sentence_transformer_ef)
-
-    # 2. Load Data
-    csv_path = 'emails.csv'
-    if not os.path.exists(csv_path):
-        print("emails.csv not found!")
-        return
+METADATA_FIELDS = HEADER_FIELDS + ['date_ts']
+CORPUS_COLUMNS = ['parsed_content', 'category', 'content_hash', 'simhash'] + METADATA_FIELDS
 
-    print("Loading emails...")
-    # Load a subset for demonstration speed (e.g., 2000 emails)
-    df = pd.read_csv(csv_path, nrows=2000)
-    
-    print("Processing data...")
+def select_documents(frame):
+    """Pick the documents to index from a chunk of the parsed corpus."""
+    columns = {field: frame[field].tolist() for field in METADATA_FIELDS + ['category']}
     documents = []
     metadatas = []
     ids = []
-    
-    for idx, row in df.iterrows():
-        content = parse_raw_message(row['message'])
+    signatures = []
+    seen = set()
+    for i, (content, doc_id, signature) in enumerate(zip(frame['parsed_content'], frame['content_hash'], frame['simhash'])):
         if not content.strip():
             continue
-            
-        category = auto_label(content)
-        
+        # Forwarded copies parse to the same body; index them once.
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
         documents.append(content)
-        metadatas.append({"category": category})
-        ids.append(str(idx))
-        
-    print(f"Adding {len(documents)} documents to ChromaDB...")
-    
-    # Add in batches to avoid memory issues
-    batch_size = 100
+        ids.append(doc_id)
+        # Header fields are stored as metadata so queries can filter on them.
+        metadatas.append({field: columns[field][i] for field in METADATA_FIELDS + ['category']})
+        signatures.append(None if pd.isna(signature) else int(signature))
+    return documents, metadatas, ids, signatures
+
+class StageStats:
+    """Accumulates documents and seconds spent per pipeline stage."""
+
+    def __init__(self):
+        self.docs = {}
+        self.seconds = {}
+
+    def record(self, stage, docs, seconds):
+        self.docs[stage] = self.docs.get(stage, 0) + docs
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def report(self):
+        for stage, docs in self.docs.items():
+            seconds = self.seconds[stage]
+            if seconds == 0:
+                print(f"  {stage:<12} {docs:>9} docs")
+                continue
+            rate = docs / seconds
+            print(f"  {stage:<12} {docs:>9} docs in {seconds:>8.2f}s  ({rate:,.0f} docs/sec)")
+
+def add_documents(collection, documents, metadatas, ids, batch_size, stats):
+    # Add in batches to avoid memory issues. Upsert keeps a resumed run
+    # idempotent if it re-sends documents Chroma already accepted.
     for i in range(0, len(documents), batch_size):
         end = min(i + batch_size, len(documents))
-        collection.add(
+        start = time.perf_counter()
+        collection.upsert(
             documents=documents[i:end],
             metadatas=metadatas[i:end],
             ids=ids[i:end]
         )
-        print(f"Added batch {i}-{end}")
+        stats.record('embed+add', end - i, time.perf_counter() - start)
+
+def update_duplicate_counts(collection, manifest, rep_ids, batch_size):
+    """Store how many near-duplicates each document stands for."""
+    counts = list(manifest.duplicate_counts(rep_ids).items())
+    for i in range(0, len(counts), batch_size):
+        part = counts[i:i + batch_size]
+        collection.update(ids=[doc_id for doc_id, _ in part], metadatas=[{'duplicates': n} for _, n in part])
+
+def index_chunk(collection, manifest, run_id, result, batch_size, stats, near_dup_distance=MAX_DISTANCE):
+    """Embed only the new documents of a chunk and record it in the manifest.
+
+    A new document whose SimHash is within ``near_dup_distance`` bits of a
+    stored one (negative disables) is recorded as that document's
+    near-duplicate instead of being embedded. Returns (embedded, collapsed).
+    """
+    documents, metadatas, ids, signatures = result
+    known = manifest.known(ids)
+    start = time.perf_counter()
+    new = []
+    reps = set()
+    for i, doc_id in enumerate(ids):
+        if doc_id in known:
+            continue
+        match = manifest.near_duplicate(signatures[i], near_dup_distance)
+        if match is None:
+            new.append(i)
+        else:
+            reps.add(match[0])
+        manifest.add(run_id, doc_id, metadatas[i]['category'], signatures[i], match and match[0])
+    collapsed = len(ids) - len(known) - len(new)
+    if len(ids) > len(known):
+        stats.record('near-dup', len(ids) - len(known), time.perf_counter() - start)
+    relabeled = [i for i, doc_id in enumerate(ids)
+                 if doc_id in known and known[doc_id][1] is None and known[doc_id][0] != metadatas[i]['category']]
+
+    add_documents(collection, [documents[i] for i in new], [dict(metadatas[i], duplicates=0) for i in new],
+                  [ids[i] for i in new], batch_size, stats)
+    if relabeled:
+        # Same body, new label: update the metadata without re-embedding.
+        collection.update(ids=[ids[i] for i in relabeled], metadatas=[metadatas[i] for i in relabeled])
+    if reps:
+        update_duplicate_counts(collection, manifest, reps, batch_size)
+    stats.record('collapsed', collapsed, 0.0)
+    stats.record('skipped', len(known), 0.0)
+    return len(new), collapsed
+
+def index_orphans(collection, manifest, run_id, orphans, csv_path, chunk_size, batch_size, stats, rows_done,
+                  near_dup_distance=MAX_DISTANCE):
+    """Index again the near-duplicates whose stored document was deleted.
+
+    Their bodies are read back from the corpus cache. Each one is collapsed
+    into another stored document if one is close enough, and embedded
+    otherwise. Returns (embedded, collapsed).
+    """
+    missing = set(orphans)
+    embedded = collapsed = 0
+    for frame in iter_corpus(CORPUS_COLUMNS, batch_size=chunk_size, csv_path=csv_path):
+        if not missing:
+            break
+        frame = frame[frame['content_hash'].isin(missing)]
+        if frame.empty:
+            continue
+        result = select_documents(frame)
+        documents, metadatas, ids, _ = result
+        missing.difference_update(ids)
+        chunk_embedded, chunk_collapsed = index_chunk(collection, manifest, run_id, result, batch_size, stats,
+                                                      near_dup_distance)
+        embedded += chunk_embedded
+        collapsed += chunk_collapsed
+        manifest.commit_chunk(run_id, ids, [m['category'] for m in metadatas], rows_done)
+    return embedded, collapsed
+
+# Bump when the stored metadata changes shape, so old indexes are rebuilt.
+INDEX_SCHEMA = 3
+
+def open_build(manifest, rebuild):
+    """Version and directory this run writes to.
+
+    A new version starts as a copy of the published one, so an incremental
+    run embeds only what changed while running apps keep reading the
+    original. The manifest always describes the version being built; an
+    unfinished build is continued rather than copied again.
+    """
+    published = read_stamp(INDEX_STAMP)
+    version = manifest.get_state('building') or None
+    if version == published:
+        # Published before the manifest was told; nothing is unfinished.
+        version = None
+    if version and not os.path.isdir(os.path.join(INDEX_VERSIONS_DIR, version)):
+        print(f"Unfinished index version {version} is gone; rebuilding.")
+        rebuild = True
+        version = None
+    if version and rebuild:
+        shutil.rmtree(os.path.join(INDEX_VERSIONS_DIR, version))
+        version = None
+    if version:
+        print(f"Continuing the unfinished build of index version {version}.")
+        return version, os.path.join(INDEX_VERSIONS_DIR, version)
+
+    version = new_version()
+    path = os.path.join(INDEX_VERSIONS_DIR, version)
+    published_path = os.path.join(INDEX_VERSIONS_DIR, published) if published else None
+    if not rebuild and manifest.count() > 0 and published_path and os.path.isdir(published_path):
+        start = time.perf_counter()
+        # The derived files are rebuilt from the collection at the end.
+        shutil.copytree(published_path, path, ignore=shutil.ignore_patterns(
+            DUPLICATES_FILE, KNN_DIRNAME, KNN_DIRNAME + '.tmp', PROTOTYPES_FILE + '*'))
+        print(f"Copied index version {published} in {time.perf_counter() - start:.1f}s")
+    else:
+        # Collections built before versioned directories, or without a
+        # manifest (row-number ids), cannot be updated incrementally.
+        if not rebuild and manifest.count() > 0:
+            print("Existing collection predates versioned index directories; rebuilding.")
+        os.makedirs(path)
+        manifest.clear()
+    manifest.set_building(version)
+    return version, path
+
+def publish(manifest, version, keep_versions):
+    """Point running apps at ``version`` and delete all but the newest
+    ``keep_versions`` versions; the ones kept may still be serving requests
+    in apps that have not switched yet."""
+    previous = read_stamp(INDEX_STAMP)
+    write_stamp(INDEX_STAMP, version)
+    manifest.set_building(None)
+    newest_first = [version] + ([previous] if previous and previous != version else [])
+    newest_first += sorted(set(os.listdir(INDEX_VERSIONS_DIR)) - set(newest_first), reverse=True)
+    for old in newest_first[max(keep_versions, 1):]:
+        shutil.rmtree(os.path.join(INDEX_VERSIONS_DIR, old), ignore_errors=True)
+
+def init_db(csv_path='emails.csv', chunk_size=2000, workers=None, max_rows=None, batch_size=100, rebuild=False,
+            export_npy=None, near_dup_distance=MAX_DISTANCE, prototypes_per_class=1, keep_versions=2):
+    print("Initializing Vector Database...")
+    if not os.path.exists(csv_path):
+        print(f"{csv_path} not found!")
+        return
+    os.makedirs(INDEX_VERSIONS_DIR, exist_ok=True)
+    manifest = IndexManifest(MANIFEST_PATH)
+    if not rebuild and manifest.count() > 0 and manifest.get_state('schema') != str(INDEX_SCHEMA):
+        print("Existing collection predates the current metadata schema; rebuilding.")
+        rebuild = True
+    version, path = open_build(manifest, rebuild)
+    manifest.set_state('schema', INDEX_SCHEMA)
+
+    # 1. Setup ChromaDB
+    chroma_client = chromadb.PersistentClient(path=path)
+
+    # Use a lightweight model for embeddings
+    sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
+
+    collection = chroma_client.get_or_create_collection(name="email_collection", embedding_function=sentence_transformer_ef)
+
+    # 2. Stream Data
+    run_id, rows_done = manifest.begin_run(file_signature(csv_path), max_rows)
+    if rows_done:
+        print(f"Resuming run {run_id} after {rows_done} committed rows.")
+    remaining = None if max_rows is None else max(max_rows - rows_done, 0)
+
+    print(f"Streaming {csv_path} in chunks of {chunk_size} rows...")
+    stats = StageStats()
+    total_start = time.perf_counter()
+    total_docs = 0
+    total_collapsed = 0
+
+    # Parsing, labeling and hashing happen once, in a process pool, when the
+    # corpus cache is built; here chunks are streamed back from it, so memory
+    # stays flat no matter how large the CSV is. If a full run finds the cache
+    # missing, chunks are embedded while later ones are still being parsed.
+    # Chunks are committed in file order, so rows_done is a safe resume point.
+    reader = iter_corpus(CORPUS_COLUMNS, batch_size=chunk_size, start_row=rows_done, max_rows=remaining, csv_path=csv_path,
+                         workers=workers)
+    while remaining != 0:
+        start = time.perf_counter()
+        frame = next(reader, None)
+        if frame is None:
+            break
+        stats.record('read', len(frame), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        result = select_documents(frame)
+        stats.record('select', len(frame), time.perf_counter() - start)
+        embedded, collapsed = index_chunk(collection, manifest, run_id, result, batch_size, stats, near_dup_distance)
+        total_docs += embedded
+        total_collapsed += collapsed
+        rows_done += len(frame)
+        documents, metadatas, ids, _ = result
+        manifest.commit_chunk(run_id, ids, [m['category'] for m in metadatas], rows_done)
+        elapsed = time.perf_counter() - total_start
+        print(f"Committed {rows_done} rows, embedded {total_docs} new documents ({total_docs / elapsed:,.0f} docs/sec), "
+              f"collapsed {total_collapsed} near-duplicates")
+
+    # Anything the manifest holds that this run did not see was removed from
+    # the CSV. Only a run over the whole file can tell.
+    if max_rows is None:
+        stale = manifest.stale(run_id)
+        stored = [doc_id for doc_id, rep in stale if rep is None]
+        for i in range(0, len(stored), batch_size):
+            collection.delete(ids=stored[i:i + batch_size])
+        gone = set(stored)
+        # Stored documents that lost some of their near-duplicates.
+        shrunk = {rep for _, rep in stale if rep is not None and rep not in gone}
+        orphans = manifest.remove([doc_id for doc_id, _ in stale])
+        update_duplicate_counts(collection, manifest, shrunk, batch_size)
+        print(f"Removed {len(stale)} documents no longer in {csv_path}.")
+        if orphans:
+            embedded, collapsed = index_orphans(collection, manifest, run_id, orphans, csv_path, chunk_size, batch_size,
+                                                stats, rows_done, near_dup_distance)
+            total_docs += embedded
+            print(f"{len(orphans)} near-duplicates lost the document they were collapsed into: "
+                  f"embedded {embedded}, collapsed {collapsed} into other documents.")
+    manifest.finish_run()
+    stored, collapsed = manifest.totals()
+
+    # The kNN export and the prototypes are written into this version's
+    # directory, so apps still serving the previous version keep reading a
+    # matching pair until they switch. If the published version (or an
+    # earlier attempt at this one) has an export, it is refreshed in its own
+    # format so the NumPy backend never serves a matrix older than the
+    # collection.
+    for existing in (path, current_index_dir()):
+        meta_path = os.path.join(existing, KNN_DIRNAME, 'meta.json')
+        if not export_npy and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                export_npy = json.load(f)['dtype']
+    if export_npy:
+        start = time.perf_counter()
+        rows = export_embeddings(collection, os.path.join(path, KNN_DIRNAME), dtype=export_npy)
+        print(f"Exported {rows} {export_npy} embeddings for the NumPy kNN backend in {time.perf_counter() - start:.1f}s")
+
+    # Category prototypes for VECTOR_MODE=prototype, rebuilt from the whole
+    # collection so they always match what was just indexed.
+    if prototypes_per_class and collection.count():
+        start = time.perf_counter()
+        n = build_prototypes(collection, os.path.join(path, PROTOTYPES_FILE), per_class=prototypes_per_class)
+        print(f"Built {n} category prototypes in {time.perf_counter() - start:.1f}s")
+
+    # The app's near-duplicate lookups read this version's own copy of the
+    # manifest, so they agree with the collection they are served with.
+    manifest.snapshot(os.path.join(path, DUPLICATES_FILE))
+
+    # Running apps switch to the new version when they see the stamp.
+    publish(manifest, version, keep_versions)
+    manifest.close()
 
+    print("Throughput per stage:")
+    stats.report()
+    if collapsed:
+        print(f"Near-duplicates: {stored + collapsed} distinct bodies stored as {stored} vectors "
+              f"({collapsed / (stored + collapsed):.1%} smaller index).")
+    if total_collapsed and stats.docs.get('embed+add'):
+        per_doc = stats.seconds['embed+add'] / stats.docs['embed+add']
+        print(f"Not embedding {total_collapsed} near-duplicates saved about {total_collapsed * per_doc:.1f}s this run.")
     print("Vector Database Initialized Successfully!")
 
 if __name__ == "__main__":
-    init_db()
+    parser = argparse.ArgumentParser(description="Index emails.csv into ChromaDB.")
+    parser.add_argument('--csv', default='emails.csv')
+    parser.add_argument('--chunk-size', type=int, default=2000, help="Rows read and committed per chunk")
+    parser.add_argument('--workers', type=int, default=None, help="Parser processes, used when the corpus cache has to be built (default: CPU count)")
+    parser.add_argument('--max-rows', type=int, default=None, help="Stop after this many rows (default: whole file)")
+    parser.add_argument('--batch-size', type=int, default=100, help="Documents per collection.add call")
+    parser.add_argument('--rebuild', action='store_true', help="Re-embed everything into a new, empty index version")
+    parser.add_argument('--keep-versions', type=int, default=2,
+                        help="Index versions kept on disk, the new one included, for apps still reading older ones")
+    parser.add_argument('--export-npy', choices=DTYPES, default=None,
+                        help="Also export the embeddings as a memory-mappable matrix for VECTOR_BACKEND=numpy")
+    parser.add_argument('--near-dup-distance', type=int, choices=range(-1, BLOCKS), default=MAX_DISTANCE,
+                        help="Collapse emails whose SimHash differs in at most this many bits into one vector (-1 disables)")
+    parser.add_argument('--prototypes-per-class', type=int, default=1,
+                        help="Category prototypes for VECTOR_MODE=prototype; more than 1 uses k-means (0 skips)")
+    args = parser.parse_args()
+    init_db(args.csv, args.chunk_size, args.workers, args.max_rows, args.batch_size, args.rebuild, args.export_npy,
+            args.near_dup_distance, args.prototypes_per_class, args.keep_versions)
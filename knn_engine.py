@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from labeling import CATEGORIES
+
+# Exported into each index version's directory by init_vectordb.py --export-npy.
+KNN_DIRNAME = "knn"
+DTYPES = ('float32', 'float16', 'int8')
+
+
+def _quantize(block, dtype, scale):
+    if dtype == 'int8':
+        return np.clip(np.rint(block / scale), -127, 127).astype(np.int8)
+    return block.astype(dtype)
+
+
+def export_embeddings(collection, out_dir, dtype='float32', page_size=5000):
+    """Copy every embedding in a Chroma collection into flat .npy files.
+
+    Writes a contiguous ``embeddings.npy`` matrix (float32, float16 or int8
+    with one global scale), the squared norm of each row, the category of
+    each row as a uint8 code and the document ids. The files are built in a
+    temporary directory and swapped in at the end, so a reader never sees a
+    half-written export.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype must be one of {DTYPES}")
+    count = collection.count()
+    if count == 0:
+        raise ValueError("Collection is empty; nothing to export.")
+    tmp_dir = out_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    def pages():
+        for offset in range(0, count, page_size):
+            page = collection.get(limit=page_size, offset=offset, include=['embeddings', 'metadatas'])
+            yield page['ids'], np.asarray(page['embeddings'], dtype=np.float32), page['metadatas']
+
+    # int8 needs the global range before anything is written.
+    scale = 1.0
+    if dtype == 'int8':
+        max_abs = max((float(np.abs(emb).max()) for _, emb, _ in pages() if len(emb)), default=1.0)
+        scale = max_abs / 127 or 1.0
+
+    dim = None
+    matrix = sq_norms = labels = ids = None
+    codes = {name: code for code, name in enumerate(CATEGORIES)}
+    row = 0
+    for page_ids, emb, metadatas in pages():
+        if matrix is None:
+            dim = emb.shape[1]
+            matrix = np.lib.format.open_memmap(os.path.join(tmp_dir, 'embeddings.npy'), mode='w+', dtype=dtype, shape=(count, dim))
+            sq_norms = np.lib.format.open_memmap(os.path.join(tmp_dir, 'sq_norms.npy'), mode='w+', dtype=np.float32, shape=(count,))
+            labels = np.lib.format.open_memmap(os.path.join(tmp_dir, 'labels.npy'), mode='w+', dtype=np.uint8, shape=(count,))
+            ids = np.lib.format.open_memmap(os.path.join(tmp_dir, 'ids.npy'), mode='w+', dtype='S64', shape=(count,))
+        end = row + len(page_ids)
+        stored = _quantize(emb, dtype, scale)
+        matrix[row:end] = stored
+        # Norms of the stored (possibly quantized) rows keep the ranking
+        # consistent with what the search actually multiplies.
+        restored = stored.astype(np.float32) * (scale if dtype == 'int8' else 1.0)
+        sq_norms[row:end] = np.einsum('ij,ij->i', restored, restored)
+        labels[row:end] = [codes.get(m.get('category'), codes['General']) for m in metadatas]
+        ids[row:end] = [i.encode() for i in page_ids]
+        row = end
+
+    for arr in (matrix, sq_norms, labels, ids):
+        if arr is not None:
+            arr.flush()
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({'count': row, 'dim': dim, 'dtype': dtype, 'scale': scale, 'categories': CATEGORIES}, f)
+
+    old_dir = out_dir + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return row
+
+
+class NumpyKNN:
+    """Exact nearest-neighbor search over a memory-mapped embedding matrix.
+
+    Ranking is by squared L2 distance, the same metric as the default Chroma
+    collection. The matrix is opened with ``mmap_mode='r'``, so every worker
+    process on the machine reads the same page-cache pages instead of
+    holding its own copy.
+    """
+
+    def __init__(self, directory, block_rows=65536):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.directory = directory
+        self.block_rows = block_rows
+        self.matrix = np.load(os.path.join(directory, 'embeddings.npy'), mmap_mode='r')
+        self.sq_norms = np.load(os.path.join(directory, 'sq_norms.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(directory, 'labels.npy'), mmap_mode='r')
+        self.categories = self.meta['categories']
+        self.scale = self.meta['scale'] if self.meta['dtype'] == 'int8' else 1.0
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def ids(self):
+        return np.load(os.path.join(self.directory, 'ids.npy'), mmap_mode='r')
+
+    def search(self, queries, k=5):
+        """Return (indices, scores) of the k nearest rows for each query.
+
+        Rows are ranked by ``q.x - |x|^2 / 2``, which orders them exactly like
+        ``|q - x|^2``. The matrix is scored block by block so the score buffer
+        (and the upcast copy of a float16/int8 matrix) stays small.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n_rows = len(self)
+        k = min(k, n_rows)
+        if k == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        best_idx = best_scores = None
+        for start in range(0, n_rows, self.block_rows):
+            block = self.matrix[start:start + self.block_rows]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores = (queries @ block.T) * self.scale - 0.5 * self.sq_norms[start:start + self.block_rows]
+            if best_idx is not None:
+                # Carry the best rows so far into this block's selection.
+                scores = np.concatenate([best_scores, scores], axis=1)
+                idx = np.concatenate([best_idx, np.broadcast_to(np.arange(start, start + block.shape[0]), (len(queries), block.shape[0]))], axis=1)
+            else:
+                idx = np.broadcast_to(np.arange(block.shape[0]), (len(queries), block.shape[0]))
+            if scores.shape[1] > k:
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                idx = np.take_along_axis(idx, keep, axis=1)
+            best_idx, best_scores = idx, scores
+
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def neighbor_categories(self, queries, k=5):
+        """Category names of the k nearest rows, nearest first, per query."""
+        indices, _ = self.search(queries, k)
+        codes = self.labels[indices.ravel()].reshape(indices.shape)
+        return [[self.categories[c] for c in row] for row in codes]
@@ -0,0 +1,92 @@
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Bump whenever the keywords or rules change, so caches of labels built with
+# the old rules are thrown away.
+LABELER_VERSION = 1
+
+# Categories in priority order: an email mentioning any Urgent keyword is
+# Urgent, otherwise Financial, otherwise HR, otherwise General.
+CATEGORY_KEYWORDS = [
+    ('Urgent', ['urgent', 'immediate', 'emergency', 'deadline', 'breach', 'asap', 'critical', 'alert', 'warning', 'high priority', 'immediate action']),
+    ('Financial', ['budget', 'invoice', 'purchase', 'financial', 'report', 'quarterly', 'bank', 'money', 'expense', 'cost', 'payment', 'transaction', 'audit', 'billing']),
+    ('HR', ['hr', 'policies', 'performance', 'review', 'insurance', 'promotion', 'holiday', 'leave', 'benefits', 'hiring', 'salary', 'recruitment', 'onboarding', 'resignation', 'interview']),
+]
+DEFAULT_CATEGORY = 'General'
+CATEGORIES = [name for name, _ in CATEGORY_KEYWORDS] + [DEFAULT_CATEGORY]
+
+
+def _build_automaton(tiers):
+    automaton = ahocorasick.Automaton()
+    for priority, (_, keywords) in enumerate(tiers):
+        for word in keywords:
+            automaton.add_word(word, priority)
+    automaton.make_automaton()
+    return automaton
+
+
+if ahocorasick is not None:
+    # _AUTOMATA[p] only knows the keywords of categories above priority p, so
+    # once a category has been found the scan only reports better ones.
+    _AUTOMATA = [_build_automaton(CATEGORY_KEYWORDS[:p]) for p in range(1, len(CATEGORY_KEYWORDS))]
+    _AUTOMATA.append(_build_automaton(CATEGORY_KEYWORDS))
+    # How far back a rescan has to start to catch a keyword overlapping the
+    # match just found.
+    _OVERLAP = [max(len(w) for _, keywords in CATEGORY_KEYWORDS[:p] for w in keywords)
+                for p in range(1, len(CATEGORY_KEYWORDS))]
+_TIERS = [(name, tuple(keywords)) for name, keywords in CATEGORY_KEYWORDS]
+
+
+def _label_automaton(text):
+    best = len(CATEGORY_KEYWORDS)
+    automaton = _AUTOMATA[-1]
+    start = 0
+    while True:
+        hit = next(automaton.iter(text, start), None)
+        if hit is None:
+            break
+        end, best = hit
+        if best == 0:
+            break
+        automaton = _AUTOMATA[best - 1]
+        start = max(0, end - _OVERLAP[best - 1] + 1)
+    if best == len(CATEGORY_KEYWORDS):
+        return DEFAULT_CATEGORY
+    return CATEGORY_KEYWORDS[best][0]
+
+
+def _label_substrings(text):
+    for name, keywords in _TIERS:
+        for word in keywords:
+            if word in text:
+                return name
+    return DEFAULT_CATEGORY
+
+
+def auto_label(text):
+    """Heuristic to label emails based on keywords.
+
+    With pyahocorasick installed all keywords are found in a single pass over
+    the text; otherwise each keyword is checked with a substring search.
+    """
+    if not isinstance(text, str):
+        return DEFAULT_CATEGORY
+    text = text.lower()
+    if ahocorasick is not None:
+        return _label_automaton(text)
+    return _label_substrings(text)
+
+
+def label_batch(texts):
+    """Label a list of texts or a pandas Series.
+
+    A Series comes back as a Series with the same index, anything else as a
+    list. Missing values are labeled General.
+    """
+    labels = [auto_label(text) for text in texts]
+    if hasattr(texts, 'index') and hasattr(texts, 'iloc'):
+        import pandas as pd
+        return pd.Series(labels, index=texts.index, name='category')
+    return labels
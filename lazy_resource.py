@@ -0,0 +1,168 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class LazyResource:
+    """Load an expensive object on first use, once, from any thread.
+
+    ``get`` returns the cached object after the first call; concurrent first
+    callers wait on a lock while one of them runs ``loader``. How long the
+    load took, and when it finished, are kept for the startup metrics.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.value = None
+        self.loaded = False
+        self.load_seconds = None
+        self.loaded_at = None
+
+    def get(self):
+        if self.loaded:
+            return self.value
+        with self.lock:
+            if not self.loaded:
+                start = time.perf_counter()
+                self.value = self.loader()
+                self.loaded_at = time.perf_counter()
+                self.load_seconds = self.loaded_at - start
+                self.loaded = True
+        return self.value
+
+    def stats(self):
+        return {'loaded': self.loaded, 'load_seconds': self.load_seconds}
+
+
+class VersionedResource(LazyResource):
+    """A LazyResource that can be replaced by a newer version while serving.
+
+    ``version_fn`` names the version the resource should be at (a stamp
+    file). ``reload`` builds the new value with ``reloader(previous)`` and
+    ``warm(value)`` while ``get`` and ``lease`` keep returning the old one,
+    then swaps it in with one assignment. Work that must see one consistent
+    value holds a ``lease``; a replaced value is kept until its last lease
+    ends and is dropped then.
+    """
+
+    def __init__(self, name, loader, version_fn, reloader=None, warm=None):
+        super().__init__(name, self._load_first)
+        self.first_loader = loader
+        self.version_fn = version_fn
+        self.reloader = reloader or (lambda previous: loader())
+        self.warm = warm
+        self.version = None
+        self.generation = 0
+        self.active = {}
+        self.retired = {}
+        self.lease_lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.reloading = None
+        self.reloads = 0
+        self.last_reload = None
+        self.failed_version = None
+        self.last_error = None
+
+    def _load_first(self):
+        # Read before loading: if the stamp moves during the load, the next
+        # check sees a newer version and reloads.
+        self.version = self.version_fn()
+        return self.first_loader()
+
+    @contextmanager
+    def lease(self):
+        self.get()
+        with self.lease_lock:
+            generation, value = self.generation, self.value
+            self.active[generation] = self.active.get(generation, 0) + 1
+        try:
+            yield value
+        finally:
+            with self.lease_lock:
+                self.active[generation] -= 1
+                if not self.active[generation]:
+                    del self.active[generation]
+                    if self.retired.pop(generation, None) is not None:
+                        print(f"Released {self.name} generation {generation} after its last request finished.")
+
+    def needs_reload(self):
+        if not self.loaded or self.reloading is not None:
+            return False
+        version = self.version_fn()
+        return version != self.version and version != self.failed_version
+
+    def reload(self):
+        """Load, warm and swap in the version ``version_fn`` names now.
+
+        Returns True if a new value was swapped in. On failure the current
+        value stays in service and that version is not retried.
+        """
+        with self.reload_lock:
+            version = self.version_fn()
+            if not self.loaded or version == self.version:
+                return False
+            self.reloading = version
+            start = time.perf_counter()
+            try:
+                value = self.reloader(self.value)
+                if self.warm is not None:
+                    self.warm(value)
+            except Exception as e:
+                print(f"Warning: Could not load {self.name} version {version}; still serving {self.version}. Error: {e}")
+                self.failed_version = version
+                self.last_error = str(e)
+                return False
+            finally:
+                self.reloading = None
+            with self.lease_lock:
+                previous = self.generation
+                if self.active.get(previous):
+                    self.retired[previous] = self.value
+                self.value = value
+                self.version = version
+                self.generation += 1
+            self.reloads += 1
+            self.last_error = None
+            self.last_reload = {'version': version, 'seconds': time.perf_counter() - start,
+                                'at': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+            print(f"Swapped in {self.name} version {version} ({self.last_reload['seconds']:.2f}s to load and warm).")
+            return True
+
+    def stats(self):
+        with self.lease_lock:
+            draining = {generation: self.active.get(generation, 0) for generation in self.retired}
+        return dict(super().stats(), version=self.version, stamp=self.version_fn(), generation=self.generation,
+                    reloading=self.reloading, reloads=self.reloads, last_reload=self.last_reload,
+                    last_error=self.last_error, draining=draining)
+
+
+class ReloadWatcher:
+    """Poll the version stamps of some VersionedResources and reload the
+    ones that changed on a background thread.
+
+    ``check`` is meant to be called on every request; it reads the stamps
+    at most every ``interval`` seconds and never blocks on a load. No
+    thread outlives a reload, so nothing is lost across a fork.
+    """
+
+    def __init__(self, resources, interval=5.0):
+        self.resources = resources
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_check = time.monotonic() + interval
+
+    def check(self):
+        if self.interval <= 0:
+            return
+        now = time.monotonic()
+        if now < self.next_check or not self.lock.acquire(blocking=False):
+            return
+        try:
+            self.next_check = now + self.interval
+            for resource in self.resources:
+                if resource.needs_reload():
+                    threading.Thread(target=resource.reload, name=f"reload-{resource.name}", daemon=True).start()
+        finally:
+            self.lock.release()
@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter, defaultdict
+
+import aiohttp
+import numpy as np
+
+from corpus_cache import load_corpus
+
+# Started with --start-server. The tables are created first, as `python app.py` does.
+SERVER_CODE = """
+import sys
+from app import app, db
+with app.app_context():
+    db.create_all()
+app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)
+"""
+# Only heuristic and vector search run, and nothing is cached, so a
+# heuristic email and a vector email cost what their names say.
+SERVER_ENV = {'CASCADE_TIERS': 'heuristic,vector', 'RESULT_CACHE_SIZE': '0'}
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000 if samples else None
+
+
+def start_server(port, env_overrides, db_dir, wait_seconds=300):
+    # The synthetic users go to a throwaway database, not instance/users.db.
+    env = dict(os.environ, **SERVER_ENV, DATABASE_URL=f"sqlite:///{os.path.abspath(db_dir)}/users.db", **env_overrides)
+    server = subprocess.Popen([sys.executable, '-c', SERVER_CODE, str(port)], env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + wait_seconds
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with status {server.returncode}")
+        try:
+            urllib.request.urlopen(url + '/login', timeout=1)
+            return server, url
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError(f"Server did not answer on {url} within {wait_seconds}s")
+
+
+def load_emails(csv_path, rows):
+    """Real emails split by how the app will settle them: keyword hits end at
+    the heuristic, the rest go on to vector search."""
+    df = load_corpus(['parsed_content', 'category'], nrows=rows, csv_path=csv_path)
+    df = df[df['parsed_content'].str.strip() != '']
+    return {'heuristic': df.loc[df['category'] != 'General', 'parsed_content'].tolist(),
+            'vector': df.loc[df['category'] == 'General', 'parsed_content'].tolist()}
+
+
+class Stats:
+    """Latencies and failures per route for one stage."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.tiers = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def summary(self, elapsed):
+        routes = {}
+        for route in sorted(set(self.latencies) | set(self.errors)):
+            ok = self.latencies[route]
+            total = len(ok) + self.errors[route]
+            routes[route] = {'requests': total, 'rps': len(ok) / elapsed, 'error_rate': self.errors[route] / total,
+                             'p50_ms': percentile_ms(ok, 50), 'p95_ms': percentile_ms(ok, 95),
+                             'p99_ms': percentile_ms(ok, 99)}
+        return routes
+
+
+async def timed(stats, route, request, expect_status):
+    stats.in_flight += 1
+    stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+    start = time.perf_counter()
+    try:
+        async with request() as response:
+            body = await response.read()
+            if response.status != expect_status:
+                stats.errors[route] += 1
+                return None
+        stats.latencies[route].append(time.perf_counter() - start)
+        return body
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        stats.errors[route] += 1
+        return None
+    finally:
+        stats.in_flight -= 1
+
+
+async def register_and_login(session, url, username, password, stats):
+    form = {'username': username, 'password': password}
+    # Both answer with a redirect on success and re-render the form on failure.
+    await timed(stats, 'register', lambda: session.post(url + '/register', data=form, allow_redirects=False), 302)
+    return await timed(stats, 'login', lambda: session.post(url + '/login', data=form, allow_redirects=False), 302)
+
+
+async def one_request(user, url, emails, vector_share, login_share, endpoint, stats):
+    session, username, password = user
+    if random.random() < login_share:
+        form = {'username': username, 'password': password}
+        await timed(stats, 'login', lambda: session.post(url + '/login', data=form, allow_redirects=False), 302)
+        return
+    kind = 'vector' if random.random() < vector_share else 'heuristic'
+    text = random.choice(emails[kind])
+    route = f"classify_{endpoint}:{kind}"
+    if endpoint == 'api':
+        body = await timed(stats, route, lambda: session.post(url + '/api/classify', json={'emails': [text]},
+                                                              allow_redirects=False), 200)
+        if body is not None:
+            stats.tiers[json.loads(body)['results'][0]['tier']] += 1
+    else:
+        await timed(stats, route, lambda: session.post(url + '/', data={'email': text}, allow_redirects=False), 200)
+
+
+async def run_stage(rate, seconds, users, url, emails, vector_share, login_share, endpoint):
+    """Open-loop load: requests start every 1/rate seconds whether or not
+    earlier ones have finished, so a slow server builds a queue instead of
+    slowing the clients down."""
+    stats = Stats()
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    start = loop.time()
+    for i in range(int(rate * seconds)):
+        delay = start + i / rate - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(one_request(users[i % len(users)], url, emails, vector_share, login_share,
+                                               endpoint, stats))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+    completed = sum(len(v) for v in stats.latencies.values())
+    failed = sum(stats.errors.values())
+    return {'offered_rps': rate, 'achieved_rps': completed / elapsed, 'seconds': elapsed,
+            'error_rate': failed / max(completed + failed, 1), 'peak_in_flight': stats.peak_in_flight,
+            'routes': stats.summary(elapsed), 'tiers': dict(stats.tiers)}
+
+
+def saturated(stage, slo_ms, max_error_rate):
+    """The server keeps up when it finishes what was offered, within the
+    latency objective, without errors."""
+    worst_p95 = max((r['p95_ms'] or 0.0) for r in stage['routes'].values()) if stage['routes'] else 0.0
+    return (stage['achieved_rps'] < 0.95 * stage['offered_rps'] or stage['error_rate'] > max_error_rate
+            or worst_p95 > slo_ms)
+
+
+def print_stage(stage):
+    print(f"\nOffered {stage['offered_rps']:g} req/s -> achieved {stage['achieved_rps']:.1f} req/s, "
+          f"errors {stage['error_rate']:.1%}, peak in flight {stage['peak_in_flight']}")
+    print(f"  {'Route':<26} | {'req':>6} | {'req/s':>7} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'errors':>6}")
+    for route, r in stage['routes'].items():
+        p = [f"{r[k]:>8.1f}" if r[k] is not None else f"{'-':>8}" for k in ('p50_ms', 'p95_ms', 'p99_ms')]
+        print(f"  {route:<26} | {r['requests']:>6} | {r['rps']:>7.1f} | {' | '.join(p)} | {r['error_rate']:>6.1%}")
+    if stage['tiers']:
+        print(f"  Tiers: {stage['tiers']}")
+
+
+async def load_test(url, emails, users=20, rates=(1, 2, 5, 10, 20, 50), stage_seconds=20, vector_share=0.3,
+                    login_share=0.02, endpoint='form', slo_ms=1000, max_error_rate=0.01, stop_at_saturation=True,
+                    timeout=30):
+    """Log in a pool of users, then step up the arrival rate until the server
+    saturates. Returns the setup stats, every stage and the highest healthy
+    rate."""
+    connector = aiohttp.TCPConnector(limit=0)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    run = time.strftime('%Y%m%d%H%M%S')
+    sessions = [aiohttp.ClientSession(connector=connector, connector_owner=False, timeout=client_timeout,
+                                      cookie_jar=aiohttp.CookieJar(unsafe=True)) for _ in range(users)]
+    try:
+        print(f"Registering and logging in {users} users...")
+        setup = Stats()
+        started = time.perf_counter()
+        names = [(f"loadtest-{run}-{i}", f"pw-{run}-{i}") for i in range(users)]
+        logins = await asyncio.gather(*(register_and_login(s, url, u, p, setup) for s, (u, p) in zip(sessions, names)))
+        setup_summary = setup.summary(time.perf_counter() - started)
+        for route, r in setup_summary.items():
+            print(f"  {route:<9} p50 {r['p50_ms'] or 0:.0f} ms, p95 {r['p95_ms'] or 0:.0f} ms, errors {r['error_rate']:.0%}")
+        pool = [(s, u, p) for s, (u, p), ok in zip(sessions, names, logins) if ok is not None]
+        if not pool:
+            raise RuntimeError("No user could log in; is the server up and the users table created?")
+
+        stages = []
+        capacity = None
+        for rate in rates:
+            stage = await run_stage(rate, stage_seconds, pool, url, emails, vector_share, login_share, endpoint)
+            stages.append(stage)
+            print_stage(stage)
+            if saturated(stage, slo_ms, max_error_rate):
+                print(f"  Saturated at {rate:g} req/s")
+                if stop_at_saturation:
+                    break
+            elif capacity is None or rate > capacity:
+                capacity = rate
+        return {'setup': setup_summary, 'stages': stages, 'capacity_rps': capacity}
+    finally:
+        for session in sessions:
+            await session.close()
+        await connector.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the Flask app with logged-in users at rising arrival rates.")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="Server to test (ignored with --start-server)")
+    parser.add_argument('--start-server', action='store_true',
+                        help="Start app.py on --port with CASCADE_TIERS=heuristic,vector and no result cache")
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE',
+                        help="Extra environment for the started server, e.g. VECTOR_BACKEND=numpy")
+    parser.add_argument('--csv', default='emails.csv')
+    parser.add_argument('--rows', type=int, default=20000, help="Corpus rows to draw emails from")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--rates', default='1,2,5,10,20,50', help="Arrival rates to step through, requests/sec")
+    parser.add_argument('--stage-seconds', type=float, default=20)
+    parser.add_argument('--vector-share', type=float, default=0.3, help="Share of emails that need vector search")
+    parser.add_argument('--login-share', type=float, default=0.02, help="Share of requests that are fresh logins")
+    parser.add_argument('--endpoint', choices=['form', 'api'], default='form',
+                        help="POST the index form, or /api/classify (which also reports the deciding tier)")
+    parser.add_argument('--slo-ms', type=float, default=1000, help="p95 latency above which a stage counts as saturated")
+    parser.add_argument('--keep-going', action='store_true', help="Run every rate even after saturation")
+    parser.add_argument('-o', '--output', default='load_results.json')
+    args = parser.parse_args()
+
+    emails = load_emails(args.csv, args.rows)
+    print(f"Email pool: {len(emails['heuristic'])} heuristic, {len(emails['vector'])} vector")
+    if not emails['heuristic'] or not emails['vector']:
+        # Send everything to the kind there are emails of.
+        args.vector_share = 1.0 if emails['vector'] else 0.0
+    server = None
+    url = args.url
+    db_dir = tempfile.TemporaryDirectory(prefix='load_test-')
+    try:
+        if args.start_server:
+            server, url = start_server(args.port, dict(kv.split('=', 1) for kv in args.server_env), db_dir.name)
+        result = asyncio.run(load_test(url, emails, args.users, [float(r) for r in args.rates.split(',')],
+                                       args.stage_seconds, args.vector_share, args.login_share, args.endpoint,
+                                       args.slo_ms, stop_at_saturation=not args.keep_going))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        db_dir.cleanup()
+    with open(args.output, 'w') as f:
+        json.dump(dict(result, url=url, users=args.users, vector_share=args.vector_share,
+                       login_share=args.login_share, endpoint=args.endpoint), f, indent=2)
+    if result['capacity_rps'] is None:
+        print("\nSaturated at the lowest rate tried.")
+    else:
+        print(f"\nHighest rate served within {args.slo_ms:g} ms p95: {result['capacity_rps']:g} req/s")
+    print(f"Results saved to {args.output}")
@@ -0,0 +1,154 @@
+import bisect
+import threading
+import time
+
+# Latency buckets in seconds, from 50us to 10s. Every series keeps one
+# counter per bucket, so memory does not grow with traffic.
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram, one series per label combination."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *label_values):
+        """Context manager that observes the time spent inside it."""
+        return _Timer(self, label_values)
+
+    def totals(self):
+        """(sum, count) of the observations per label combination."""
+        with self.lock:
+            return {labels: (total, n) for labels, (_, total, n) in self.series.items()}
+
+    def samples(self):
+        with self.lock:
+            snapshot = [(labels, list(counts), total, n) for labels, (counts, total, n) in self.series.items()]
+        for labels, counts, total, n in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', labels, (('le', _format_value(bound)),), cumulative
+            yield '_sum', labels, (), total
+            yield '_count', labels, (), n
+
+
+class _Timer:
+    __slots__ = ('histogram', 'label_values', 'start')
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class Counter:
+    """Monotonic counter, one series per label combination."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            snapshot = sorted(self.series.items())
+        for labels, value in snapshot:
+            yield '', labels, (), value
+
+
+class Callback:
+    """A counter or gauge read from existing state when metrics are scraped.
+
+    ``fn`` returns a number, or a dict mapping label-value tuples to numbers.
+    """
+
+    def __init__(self, name, help_text, kind, fn, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.fn = fn
+        self.label_names = tuple(label_names)
+
+    def samples(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            yield '', labels, (), value
+
+
+class Registry:
+    """Metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def counter(self, name, help_text, label_names=()):
+        return self.register(Counter(name, help_text, label_names))
+
+    def callback(self, name, help_text, kind, fn, label_names=()):
+        return self.register(Callback(name, help_text, kind, fn, label_names))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, extra, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(metric.label_names, labels, extra)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,128 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Coalesce concurrent calls to a batch function into one call.
+
+    Callers hand a list of items to ``map`` and block on the result. A single
+    background thread drains the queue: once an item arrives it waits up to
+    ``window_ms`` for more, or until ``max_batch`` items are collected, then
+    calls ``batch_fn`` once for all of them and hands each caller its slice
+    of the output. Calls with more than ``max_batch`` items are split into
+    ``max_batch`` chunks, and a call that would overflow the current batch
+    waits for the next one, so no batch exceeds ``max_batch``.
+    """
+
+    def __init__(self, batch_fn, max_batch=64, window_ms=5.0):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self.jobs = queue.Queue()
+        # A job taken off the queue that did not fit in the last batch.
+        self.carry = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.batches = 0
+        self.items = 0
+        self.max_queue_depth = 0
+        # Batch size histogram with power-of-two upper bounds.
+        self.size_buckets = {}
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so each worker process starts its own.
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            if self.pid != os.getpid():
+                # The parent's queue may hold jobs nobody here will answer.
+                self.jobs = queue.Queue()
+                self.carry = None
+                self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self.thread.start()
+
+    def map(self, items):
+        """Run ``batch_fn`` over ``items`` as part of a shared batch."""
+        if not items:
+            return []
+        chunks = [items[start:start + self.max_batch] for start in range(0, len(items), self.max_batch)]
+        if self.window <= 0:
+            return [output for chunk in chunks for output in self.batch_fn(chunk)]
+        self._ensure_worker()
+        futures = []
+        for chunk in chunks:
+            future = Future()
+            self.jobs.put((chunk, future))
+            futures.append(future)
+        depth = self.jobs.qsize()
+        with self.lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+        return [output for future in futures for output in future.result()]
+
+    def _collect(self):
+        if self.carry is not None:
+            jobs = [self.carry]
+            self.carry = None
+        else:
+            jobs = [self.jobs.get()]
+        size = len(jobs[0][0])
+        deadline = time.monotonic() + self.window
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self.jobs.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(job[0]) > self.max_batch:
+                self.carry = job
+                break
+            jobs.append(job)
+            size += len(job[0])
+        return jobs, size
+
+    def _run(self):
+        while True:
+            jobs, size = self._collect()
+            try:
+                items = [item for job_items, _ in jobs for item in job_items]
+                outputs = self.batch_fn(items)
+                if len(outputs) != size:
+                    raise RuntimeError(f"batch function returned {len(outputs)} results for {size} items")
+                start = 0
+                for job_items, future in jobs:
+                    future.set_result(outputs[start:start + len(job_items)])
+                    start += len(job_items)
+                self._record(size)
+            except BaseException as e:
+                # The thread keeps serving and no caller is left waiting,
+                # whatever went wrong with this batch.
+                for _, future in jobs:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _record(self, size):
+        bucket = 1
+        while bucket < size:
+            bucket *= 2
+        with self.lock:
+            self.batches += 1
+            self.items += size
+            self.size_buckets[bucket] = self.size_buckets.get(bucket, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queue_depth': self.jobs.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+                'batch_size_histogram': {f"<={b}": n for b, n in sorted(self.size_buckets.items())},
+            }
@@ -0,0 +1,296 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from labeling import LABELER_VERSION
+from version_stamps import new_version, read_stamp, write_stamp
+
+BUNDLE_DIR = "model_bundle"
+FORMAT_VERSION = 1
+# Versions kept on disk, newest first; a server still mapping an older one
+# keeps its open files even after they are deleted.
+KEEP_VERSIONS = 2
+
+# Vectorizer settings needed to rebuild the analyzer at load time. Anything
+# learned from data (vocabulary, IDF) is stored as an array instead.
+_ANALYZER_PARAMS = ['analyzer', 'lowercase', 'strip_accents', 'token_pattern', 'ngram_range', 'stop_words']
+_VECTORIZER_PARAMS = {
+    'tfidf': _ANALYZER_PARAMS + ['binary', 'norm', 'use_idf', 'smooth_idf', 'sublinear_tf'],
+    'hashing': _ANALYZER_PARAMS + ['binary', 'norm', 'n_features', 'alternate_sign'],
+}
+
+
+def _vectorizer_spec(vectorizer):
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+
+    if isinstance(vectorizer, TfidfVectorizer):
+        kind = 'tfidf'
+    elif isinstance(vectorizer, HashingVectorizer):
+        kind = 'hashing'
+    else:
+        raise ValueError(f"Cannot bundle a {type(vectorizer).__name__}; expected TfidfVectorizer or HashingVectorizer.")
+    params = vectorizer.get_params()
+    if params.get('preprocessor') is not None or params.get('tokenizer') is not None or not isinstance(params['analyzer'], str):
+        raise ValueError("Cannot bundle a vectorizer with a custom analyzer, preprocessor or tokenizer.")
+    spec = {name: params[name] for name in _VECTORIZER_PARAMS[kind]}
+    if isinstance(spec['stop_words'], (list, tuple, set, frozenset)):
+        spec['stop_words'] = sorted(spec['stop_words'])
+    spec['ngram_range'] = list(spec['ngram_range'])
+    return kind, spec
+
+
+def _probability_kind(model):
+    from sklearn.linear_model import LogisticRegression, SGDClassifier
+
+    if isinstance(model, LogisticRegression):
+        if model.solver == 'liblinear' or getattr(model, 'multi_class', 'auto') == 'ovr':
+            return 'ovr'
+        return 'softmax'
+    if isinstance(model, SGDClassifier) and model.loss == 'log_loss':
+        return 'ovr'
+    raise ValueError(f"Cannot bundle a {type(model).__name__}; expected a logistic regression.")
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_array(directory, name, array):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+        f.flush()
+        os.fsync(f.fileno())
+    return {'sha256': _sha256(path), 'bytes': os.path.getsize(path),
+            'dtype': str(array.dtype), 'shape': list(array.shape)}
+
+
+def save_bundle(model, vectorizer, training=None, bundle_dir=BUNDLE_DIR, keep=KEEP_VERSIONS):
+    """Write a model/vectorizer pair as a new bundle version and publish it.
+
+    The coefficients, intercepts, IDF weights and vocabulary go into .npy
+    files that load with ``mmap_mode='r'``. The vocabulary is stored sorted
+    as UTF-8 bytes, and the coefficient and IDF columns are reordered to
+    match, so a term's position in ``vocab.npy`` is its feature index.
+    ``manifest.json`` records the SHA-256 of every file, the vectorizer
+    settings, the labeler version and the ``training`` config.
+
+    The version directory is fully written before ``CURRENT`` is switched to
+    it with an atomic rename, so a reader never sees a partial model.
+    Returns the new version.
+    """
+    kind, spec = _vectorizer_spec(vectorizer)
+    probability = _probability_kind(model)
+    coef = np.asarray(model.coef_, dtype=np.float32)
+    arrays = {'intercept.npy': np.asarray(model.intercept_, dtype=np.float32)}
+    if kind == 'tfidf':
+        terms = sorted(vectorizer.vocabulary_, key=lambda t: t.encode('utf-8'))
+        columns = np.array([vectorizer.vocabulary_[t] for t in terms], dtype=np.int64)
+        arrays['vocab.npy'] = np.array([t.encode('utf-8') for t in terms], dtype=bytes)
+        coef = coef[:, columns]
+        if spec['use_idf']:
+            arrays['idf.npy'] = np.asarray(vectorizer.idf_, dtype=np.float32)[columns]
+    arrays['coef.npy'] = coef
+
+    version = new_version()
+    os.makedirs(bundle_dir, exist_ok=True)
+    tmp_dir = os.path.join(bundle_dir, version + '.tmp')
+    os.makedirs(tmp_dir)
+    files = {name: _write_array(tmp_dir, name, array) for name, array in arrays.items()}
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'version': version,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'labeler_version': LABELER_VERSION,
+        'classes': [str(c) for c in model.classes_],
+        'model': {'type': type(model).__name__, 'probability': probability},
+        'vectorizer': {'kind': kind, 'params': spec},
+        'training': training or {},
+        'files': files,
+    }
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_dir, os.path.join(bundle_dir, version))
+    write_stamp(os.path.join(bundle_dir, 'CURRENT'), version)
+    _prune(bundle_dir, version, keep)
+    return version
+
+
+def _prune(bundle_dir, current, keep):
+    versions = sorted((name for name in os.listdir(bundle_dir)
+                       if os.path.isfile(os.path.join(bundle_dir, name, 'manifest.json'))), reverse=True)
+    keep_set = {current, *versions[:keep]}
+    for name in os.listdir(bundle_dir):
+        path = os.path.join(bundle_dir, name)
+        if os.path.isdir(path) and name not in keep_set:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def current_version(bundle_dir=BUNDLE_DIR):
+    """Version that ``CURRENT`` points at, or None if nothing was published."""
+    return read_stamp(os.path.join(bundle_dir, 'CURRENT'))
+
+
+class ModelBundle:
+    """A published model, served straight from its memory-mapped arrays.
+
+    Opening a bundle only reads the manifest and maps the arrays, so every
+    worker process shares the same read-only pages. It exposes
+    ``transform``, ``predict_proba``, ``predict`` and ``classes_``, the parts
+    of the scikit-learn API the app uses, and needs no pickle.
+    """
+
+    def __init__(self, directory, verify=True):
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"{directory}: unsupported bundle format {self.manifest.get('format_version')}.")
+        self.directory = directory
+        self.version = self.manifest['version']
+        for name, info in self.manifest['files'].items():
+            path = os.path.join(directory, name)
+            if os.path.getsize(path) != info['bytes']:
+                raise ValueError(f"{path}: expected {info['bytes']} bytes, found {os.path.getsize(path)}.")
+            if verify and _sha256(path) != info['sha256']:
+                raise ValueError(f"{path}: checksum mismatch.")
+        if self.manifest['labeler_version'] != LABELER_VERSION:
+            print(f"Warning: model {self.version} was trained on labeler version "
+                  f"{self.manifest['labeler_version']}, current is {LABELER_VERSION}. Retrain with train_model.py.")
+
+        self.classes_ = np.array(self.manifest['classes'], dtype=object)
+        self.coef = self._load('coef.npy')
+        self.intercept = np.load(os.path.join(directory, 'intercept.npy'))
+        self.vocab = self._load('vocab.npy')
+        self.idf = self._load('idf.npy')
+        self.kind = self.manifest['vectorizer']['kind']
+        self.params = self.manifest['vectorizer']['params']
+        self._analyzer = None
+
+    def _load(self, name):
+        if name not in self.manifest['files']:
+            return None
+        return np.load(os.path.join(self.directory, name), mmap_mode='r')
+
+    def _build_analyzer(self):
+        from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+
+        params = dict(self.params, ngram_range=tuple(self.params['ngram_range']))
+        if self.kind == 'hashing':
+            # Stateless: the vectorizer itself is the whole feature map.
+            return HashingVectorizer(**params).transform
+        return TfidfVectorizer(**{k: params[k] for k in _ANALYZER_PARAMS}).build_analyzer()
+
+    def transform(self, texts):
+        """Feature matrix for ``texts``, identical to the original vectorizer's."""
+        if self._analyzer is None:
+            self._analyzer = self._build_analyzer()
+        if self.kind == 'hashing':
+            return self._analyzer(texts)
+
+        width = self.vocab.dtype.itemsize
+        indices, indptr = [], [0]
+        for text in texts:
+            tokens = [t.encode('utf-8') for t in self._analyzer(text)]
+            tokens = np.array([t for t in tokens if len(t) <= width], dtype=self.vocab.dtype)
+            if len(tokens):
+                pos = np.minimum(np.searchsorted(self.vocab, tokens), len(self.vocab) - 1)
+                indices.append(pos[self.vocab[pos] == tokens])
+                indptr.append(indptr[-1] + len(indices[-1]))
+            else:
+                indptr.append(indptr[-1])
+        indices = np.concatenate(indices) if indices else np.empty(0, dtype=np.int64)
+        X = sp.csr_matrix((np.ones(len(indices), dtype=np.float64), indices, indptr),
+                          shape=(len(indptr) - 1, len(self.vocab)))
+        X.sum_duplicates()
+        if self.params['binary']:
+            X.data[:] = 1
+        elif self.params['sublinear_tf']:
+            np.log(X.data, X.data)
+            X.data += 1
+        if self.idf is not None:
+            X.data *= self.idf[X.indices]
+        if self.params['norm'] is not None:
+            from sklearn.preprocessing import normalize
+            X = normalize(X, norm=self.params['norm'], copy=False)
+        return X
+
+    def decision_function(self, X):
+        return np.asarray(X @ self.coef.T) + self.intercept
+
+    def predict_proba(self, X):
+        scores = self.decision_function(X)
+        if scores.shape[1] == 1:
+            positive = 1 / (1 + np.exp(-scores[:, 0]))
+            return np.column_stack([1 - positive, positive])
+        if self.manifest['model']['probability'] == 'softmax':
+            scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+        else:
+            scores = 1 / (1 + np.exp(-scores))
+        return scores / scores.sum(axis=1, keepdims=True)
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def load_bundle(bundle_dir=BUNDLE_DIR, verify=True):
+    """Open the version ``CURRENT`` points at.
+
+    With ``verify`` every file is checked against its manifest checksum;
+    file sizes are always checked. Raises FileNotFoundError if no bundle was
+    published and ValueError if it fails the checks.
+    """
+    version = current_version(bundle_dir)
+    if version is None:
+        raise FileNotFoundError(f"No model bundle published in {bundle_dir}/.")
+    return ModelBundle(os.path.join(bundle_dir, version), verify=verify)
+
+
+def load_model(bundle_dir=BUNDLE_DIR, legacy_model='model.pkl', legacy_vectorizer='vectorizer.pkl'):
+    """(model, vectorizer) to serve: the current bundle, returned as both.
+
+    Trees that predate bundles still have pickles; they are loaded instead,
+    with a hint to convert them.
+    """
+    if current_version(bundle_dir) is not None:
+        bundle = load_bundle(bundle_dir)
+        return bundle, bundle
+    import pickle
+    with open(legacy_model, 'rb') as f:
+        model = pickle.load(f)
+    with open(legacy_vectorizer, 'rb') as f:
+        vectorizer = pickle.load(f)
+    print(f"Loaded legacy {legacy_model}/{legacy_vectorizer}; run 'python model_bundle.py --convert' to bundle them.")
+    return model, vectorizer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert model.pkl/vectorizer.pkl into a model bundle, or check the current one.")
+    parser.add_argument('--convert', action='store_true', help="Bundle the pickled model and vectorizer")
+    parser.add_argument('--model', default='model.pkl')
+    parser.add_argument('--vectorizer', default='vectorizer.pkl')
+    parser.add_argument('--dir', default=BUNDLE_DIR)
+    args = parser.parse_args()
+    if args.convert:
+        import pickle
+        with open(args.model, 'rb') as f:
+            model = pickle.load(f)
+        with open(args.vectorizer, 'rb') as f:
+            vectorizer = pickle.load(f)
+        version = save_bundle(model, vectorizer, {'source': [args.model, args.vectorizer]}, args.dir)
+        print(f"Published model bundle {version} in {args.dir}/")
+    start = time.perf_counter()
+    bundle = load_bundle(args.dir)
+    print(f"Model bundle {bundle.version} OK ({bundle.manifest['vectorizer']['kind']}, "
+          f"classes {list(bundle.classes_)}), verified in {(time.perf_counter() - start) * 1000:.1f} ms")
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+# 64-bit SimHash over word 3-shingles. Two bodies whose signatures differ in
+# at most MAX_DISTANCE bits are treated as copies of each other.
+SHINGLE_WORDS = 3
+# Signatures are split into BLOCKS 16-bit blocks. Two signatures within
+# BLOCKS - 1 bits of each other agree on at least one whole block, so only
+# documents sharing a block need to be compared.
+BLOCKS = 4
+MAX_DISTANCE = 3
+# Snapshot of the index manifest written into each index version directory
+# for the app's lookups.
+DUPLICATES_FILE = "duplicates.db"
+_MASK = (1 << 64) - 1
+_WORD = re.compile(r'\w+')
+
+
+def simhash(text):
+    """SimHash of a text as a signed 64-bit int (what SQLite stores), or None
+    if it has no words."""
+    words = _WORD.findall(text.lower()) if isinstance(text, str) else []
+    if not words:
+        return None
+    if len(words) < SHINGLE_WORDS:
+        shingles = [' '.join(words)]
+    else:
+        shingles = [' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    digests = b''.join(hashlib.blake2b(s.encode('utf-8', 'surrogatepass'), digest_size=8).digest() for s in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    # Each bit of the signature is the majority vote of that bit over all shingles.
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(shingles)
+    return int(np.packbits(majority, bitorder='little').view('<i8')[0])
+
+
+def hamming(a, b):
+    return bin((a ^ b) & _MASK).count('1')
+
+
+def signature_blocks(signature):
+    unsigned = signature & _MASK
+    return [(unsigned >> (16 * i)) & 0xFFFF for i in range(BLOCKS)]
+
+
+def find_near_duplicate(conn, signature, max_distance=MAX_DISTANCE):
+    """Closest stored document within ``max_distance`` bits, as
+    (id, category, distance), or None.
+
+    ``conn`` is a connection to the index manifest; only documents stored in
+    the collection (not the copies collapsed into them) are candidates.
+    """
+    if signature is None or max_distance < 0:
+        return None
+    if max_distance >= BLOCKS:
+        raise ValueError(f"max_distance must be below {BLOCKS}")
+    blocks = signature_blocks(signature)
+    # One indexed probe per block; a UNION keeps SQLite from scanning.
+    query = ' UNION '.join(f"SELECT id, category, simhash FROM docs WHERE b{i} = ? AND rep IS NULL" for i in range(BLOCKS))
+    rows = conn.execute(query, blocks)
+    best = None
+    for doc_id, category, other in rows:
+        distance = hamming(signature, other)
+        if distance <= max_distance and (best is None or distance < best[2]):
+            best = (doc_id, category, distance)
+    return best
+
+
+class NearDuplicateLookup:
+    """Read-only near-duplicate lookups for the app, against the manifest
+    snapshot of one index version.
+
+    Each thread gets its own SQLite connection.
+    """
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self.local.conn = conn
+        return conn
+
+    def lookup(self, texts, max_distance=MAX_DISTANCE):
+        """(id, category, distance) of a stored near-copy per text, or None."""
+        conn = self._conn()
+        return [find_near_duplicate(conn, simhash(text), max_distance) for text in texts]
@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+
+from labeling import CATEGORIES
+
+# Rebuilt by init_vectordb.py after every run.
+PROTOTYPES_FILE = "prototypes.npz"
+
+
+def _normalize(rows):
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    return rows / np.where(norms == 0, 1, norms)
+
+
+def _spherical_kmeans(rows, k, iterations, rng):
+    """k unit-length centers of unit-length rows, by cosine similarity."""
+    if len(rows) <= k:
+        return rows.copy()
+    centers = rows[rng.choice(len(rows), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = (rows @ centers.T).argmax(axis=1)
+        for j in range(k):
+            members = rows[assign == j]
+            if len(members):
+                centers[j] = members.sum(axis=0)
+        centers = _normalize(centers)
+    return centers
+
+
+def build_prototypes(collection, path, per_class=1, page_size=5000, sample_per_class=20000,
+                     iterations=20, seed=0):
+    """Compute category prototypes from the embeddings in a Chroma collection.
+
+    With ``per_class=1`` each category gets the exact mean direction of its
+    (unit-normalized) embeddings, accumulated page by page. With more, a
+    uniform sample of up to ``sample_per_class`` embeddings per category is
+    clustered with spherical k-means. The file is written to a temporary
+    name and renamed into place. Returns the number of prototypes.
+    """
+    count = collection.count()
+    if count == 0:
+        raise ValueError("Collection is empty; nothing to build prototypes from.")
+    codes = {name: code for code, name in enumerate(CATEGORIES)}
+    rng = np.random.default_rng(seed)
+    sums = {}
+    samples = {}
+    members = {code: 0 for code in range(len(CATEGORIES))}
+    for offset in range(0, count, page_size):
+        page = collection.get(limit=page_size, offset=offset, include=['embeddings', 'metadatas'])
+        rows = _normalize(np.asarray(page['embeddings'], dtype=np.float32))
+        labels = np.array([codes.get(m.get('category'), codes['General']) for m in page['metadatas']])
+        for code in np.unique(labels):
+            class_rows = rows[labels == code]
+            members[code] += len(class_rows)
+            if per_class == 1:
+                sums[code] = sums.get(code, 0) + class_rows.sum(axis=0)
+                continue
+            # Bottom-k sampling on random keys keeps a uniform sample of a
+            # stream in bounded memory.
+            keys = rng.random(len(class_rows))
+            if code in samples:
+                keys = np.concatenate([samples[code][0], keys])
+                class_rows = np.concatenate([samples[code][1], class_rows])
+            if len(keys) > sample_per_class:
+                keep = np.argpartition(keys, sample_per_class - 1)[:sample_per_class]
+                keys, class_rows = keys[keep], class_rows[keep]
+            samples[code] = (keys, class_rows)
+
+    centroids, labels = [], []
+    for code in sorted(sums or samples):
+        if per_class == 1:
+            centers = _normalize(sums[code][None, :])
+        else:
+            centers = _spherical_kmeans(samples[code][1], per_class, iterations, rng)
+        centroids.append(centers)
+        labels.extend([code] * len(centers))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, centroids=np.concatenate(centroids).astype(np.float32), labels=np.array(labels, dtype=np.uint8),
+                 categories=np.array(CATEGORIES), members=np.array([members[c] for c in range(len(CATEGORIES))]),
+                 per_class=per_class)
+    os.replace(tmp_path, path)
+    return len(labels)
+
+
+class Prototypes:
+    """Classify embeddings by their most similar category prototype.
+
+    A category's score is the best cosine similarity between the query and
+    any of its prototypes, so a query costs one small matrix product no
+    matter how large the collection is.
+    """
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.centroids = data['centroids']
+            self.labels = data['labels']
+            self.categories = [str(c) for c in data['categories']]
+            self.per_class = int(data['per_class'])
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def scores(self, queries):
+        """(n_queries, n_categories) cosine scores; -1 where a category has no prototype."""
+        sims = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32))) @ self.centroids.T
+        scores = np.full((len(sims), len(self.categories)), -1.0, dtype=np.float32)
+        for code in np.unique(self.labels):
+            scores[:, code] = sims[:, self.labels == code].max(axis=1)
+        return scores
+
+    def classify(self, queries):
+        """Best category per query and its margin over the runner-up."""
+        scores = self.scores(queries)
+        top_two = -np.partition(-scores, 1, axis=1)[:, :2]
+        return [self.categories[c] for c in scores.argmax(axis=1)], top_two[:, 0] - top_two[:, 1]
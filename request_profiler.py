@@ -0,0 +1,180 @@
+import argparse
+import cProfile
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_DIR = "profiles"
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+
+def collapse_stack(frame, root):
+    """One line of the collapsed-stack format, outermost frame first."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join([root] + labels[::-1])
+
+
+class StackSampler:
+    """Samples the Python stacks of a few threads at a fixed interval.
+
+    Runs on its own thread, so it also sees time spent in C code that
+    releases the GIL (tokenizers, torch, SQLite). ``threads`` maps a thread
+    id to the root label its stacks are filed under.
+    """
+
+    def __init__(self, threads, interval):
+        self.threads = threads
+        self.interval = interval
+        self.counts = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.counts
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, root in self.threads.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.counts[collapse_stack(frame, root)] += 1
+
+
+class RequestProfiler:
+    """Opt-in profiling of individual requests into a bounded on-disk ring.
+
+    A request is profiled when a random draw falls under ``sample_percent``,
+    or when it carries ``header`` set to ``token``. A profiled request
+    writes ``<time>-<route>-<pid>.stacks`` (collapsed stack samples of the
+    request thread and of ``extra_threads()``) and, with ``use_cprofile``, a
+    matching ``.prof`` file for pstats/snakeviz. Only the newest
+    ``ring_size`` requests are kept. When neither a percentage nor a token
+    is set, ``start`` returns after one comparison.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, sample_percent=0.0, token=None, header='X-Profile', ring_size=200,
+                 interval_ms=2.0, use_cprofile=False, extra_threads=None):
+        self.directory = directory
+        self.sample_percent = sample_percent
+        self.token = token
+        self.header = header
+        self.ring_size = ring_size
+        self.interval = interval_ms / 1000.0
+        self.use_cprofile = use_cprofile
+        self.extra_threads = extra_threads or (lambda: {})
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.profiled = 0
+
+    def start(self, headers):
+        """Begin profiling the current request if it is selected."""
+        if self.sample_percent <= 0 and not self.token:
+            return
+        requested = self.token and headers.get(self.header) == self.token
+        if not requested and random.random() * 100 >= self.sample_percent:
+            return
+        threads = {threading.get_ident(): 'request'}
+        threads.update({ident: name for ident, name in self.extra_threads().items() if ident is not None})
+        sampler = StackSampler(threads, self.interval)
+        profile = cProfile.Profile() if self.use_cprofile else None
+        self.local.active = (sampler, profile, time.perf_counter())
+        sampler.start()
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:
+                # Only one cProfile can run at a time on Python 3.12+; a
+                # concurrent profiled request keeps just its stack samples.
+                self.local.active = (sampler, None, time.perf_counter())
+
+    def stop(self, route):
+        """Finish the current request's profile, if any, and save it."""
+        active = getattr(self.local, 'active', None)
+        if active is None:
+            return None
+        self.local.active = None
+        sampler, profile, started = active
+        if profile is not None:
+            profile.disable()
+        counts = sampler.stop()
+        elapsed = time.perf_counter() - started
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"{time.time_ns()}-{route}-{os.getpid()}")
+        with open(base + '.stacks.tmp', 'w') as f:
+            f.write(f"# route={route} seconds={elapsed:.6f} samples={sum(counts.values())}\n")
+            for stack, n in counts.most_common():
+                f.write(f"{stack} {n}\n")
+        os.replace(base + '.stacks.tmp', base + '.stacks')
+        if profile is not None:
+            profile.dump_stats(base + '.prof')
+        with self.lock:
+            self.profiled += 1
+            self._prune()
+        return base
+
+    def _prune(self):
+        runs = sorted(name[:-len('.stacks')] for name in os.listdir(self.directory) if name.endswith('.stacks'))
+        for run in runs[:max(len(runs) - self.ring_size, 0)]:
+            for ext in ('.stacks', '.prof'):
+                try:
+                    os.remove(os.path.join(self.directory, run + ext))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        saved = len([n for n in os.listdir(self.directory) if n.endswith('.stacks')]) if os.path.isdir(self.directory) else 0
+        return {'sample_percent': self.sample_percent, 'header_enabled': bool(self.token), 'cprofile': self.use_cprofile,
+                'profiled_requests': self.profiled, 'saved_profiles': saved, 'ring_size': self.ring_size}
+
+
+def aggregate(directory=PROFILE_DIR, route=None):
+    """Merge saved stack samples into one collapsed-stack text.
+
+    The output feeds straight into flamegraph.pl or speedscope. ``route``
+    limits it to one endpoint.
+    """
+    totals = Counter()
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.stacks'):
+                continue
+            if route is not None and name.split('-', 1)[1].rsplit('-', 1)[0] != route:
+                continue
+            with open(os.path.join(directory, name)) as f:
+                for line in f:
+                    if line.startswith('#') or not line.strip():
+                        continue
+                    stack, n = line.rstrip('\n').rsplit(' ', 1)
+                    totals[stack] += int(n)
+    return ''.join(f"{stack} {n}\n" for stack, n in sorted(totals.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge saved request profiles into a collapsed-stack file.")
+    parser.add_argument('--dir', default=PROFILE_DIR)
+    parser.add_argument('--route', default=None, help="Only this endpoint (e.g. index, api_classify)")
+    parser.add_argument('-o', '--output', default=None, help="Write here instead of stdout")
+    args = parser.parse_args()
+    collapsed = aggregate(args.dir, args.route)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(collapsed)
+        print(f"Wrote {len(collapsed.splitlines())} stacks to {args.output}")
+    else:
+        sys.stdout.write(collapsed)
@@ -0,0 +1,93 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Every tier lowercases its input, so case does not change the answer.
+
+    Whitespace is kept as is: the keyword heuristic matches phrases like
+    'high priority' literally, so 'high\\npriority' can be labeled differently.
+    """
+    return text.lower()
+
+
+def text_key(text):
+    return hashlib.sha1(normalize_text(text).encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class ResultCache:
+    """Thread-safe LRU cache of classification results.
+
+    Entries are keyed by a hash of the lowercased email text and tagged with
+    the version of the artifacts that produced them. ``version_fn`` is polled
+    at most every ``check_interval`` seconds; when it returns something new
+    the cache is emptied.
+    """
+
+    def __init__(self, max_size=10000, ttl=None, version_fn=None, check_interval=1.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version_fn = version_fn
+        self.check_interval = check_interval
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.version = version_fn() if version_fn else None
+        self.next_check = time.monotonic() + check_interval
+
+    def _check_version(self, now):
+        if self.version_fn is None or now < self.next_check:
+            return
+        self.next_check = now + self.check_interval
+        version = self.version_fn()
+        if version != self.version:
+            self.version = version
+            self.entries.clear()
+            self.invalidations += 1
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            self._check_version(now)
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl and now - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        now = time.monotonic()
+        with self.lock:
+            self.entries[key] = (now, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'version': self.version,
+            }
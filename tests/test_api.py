@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'users.db'))
+
+import pytest
+
+import app as email_app
+
+
+@pytest.fixture
+def client():
+    with email_app.app.app_context():
+        email_app.db.create_all()
+    client = email_app.app.test_client()
+    client.post('/register', data={'username': 'tester', 'password': 'secret'})
+    client.post('/login', data={'username': 'tester', 'password': 'secret'})
+    return client
+
+
+def test_classify_rejects_oversized_batch(client, monkeypatch):
+    monkeypatch.setitem(email_app.app.config, 'MAX_BATCH_EMAILS', 3)
+    response = client.post('/api/classify', json={'emails': ['urgent'] * 4})
+    assert response.status_code == 413
+    assert 'error' in response.get_json()
+
+
+def test_classify_accepts_batch_at_limit(client, monkeypatch):
+    monkeypatch.setitem(email_app.app.config, 'MAX_BATCH_EMAILS', 3)
+    response = client.post('/api/classify', json={'emails': ['urgent deadline'] * 3})
+    assert response.status_code == 200
+    assert [r['label'] for r in response.get_json()['results']] == ['Urgent'] * 3
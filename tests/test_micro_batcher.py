@@ -0,0 +1,48 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from micro_batcher import MicroBatcher
+
+
+def test_batches_never_exceed_max_batch():
+    batch_sizes = []
+
+    def batch_fn(items):
+        batch_sizes.append(len(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(batch_fn, max_batch=8, window_ms=50)
+    sizes = [5, 6, 3, 7, 2, 8, 1, 4]
+    results = {}
+    start = threading.Barrier(len(sizes))
+
+    def call(n):
+        items = list(range(n))
+        start.wait()
+        results[n] = batcher.map(items)
+
+    threads = [threading.Thread(target=call, args=(n,)) for n in sizes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(batch_sizes) == sum(sizes)
+    assert max(batch_sizes) <= 8
+    for n in sizes:
+        assert results[n] == [item * 2 for item in range(n)]
+
+
+def test_large_call_is_split():
+    batch_sizes = []
+
+    def batch_fn(items):
+        batch_sizes.append(len(items))
+        return items
+
+    batcher = MicroBatcher(batch_fn, max_batch=4, window_ms=5)
+    assert batcher.map(list(range(10))) == list(range(10))
+    assert max(batch_sizes) <= 4
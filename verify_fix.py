@@ -1,33 +1,11 @@
-import pickle
 import os
-
-def auto_label(text):
-    """Heuristic to label emails based on keywords (synced with app.py)."""
-    text = text.lower()
-    
-    financial_keywords = ['budget', 'invoice', 'purchase', 'financial', 'report', 'quarterly', 'bank', 'money', 'expense', 'cost', 'payment', 'transaction', 'audit', 'billing']
-    urgent_keywords = ['urgent', 'immediate', 'emergency', 'deadline', 'breach', 'asap', 'critical', 'alert', 'warning', 'high priority', 'immediate action']
-    hr_keywords = ['hr', 'policies', 'performance', 'review', 'insurance', 'promotion', 'holiday', 'leave', 'benefits', 'hiring', 'salary', 'recruitment', 'onboarding', 'resignation', 'interview']
-    
-    for word in urgent_keywords:
-        if word in text:
-            return 'Urgent'
-    for word in financial_keywords:
-        if word in text:
-            return 'Financial'
-    for word in hr_keywords:
-        if word in text:
-            return 'HR'
-            
-    return 'General'
+from model_bundle import load_model
+from labeling import auto_label
 
 def verify():
     print("Loading model and vectorizer...")
     try:
-        with open('model.pkl', 'rb') as f:
-            model = pickle.load(f)
-        with open('vectorizer.pkl', 'rb') as f:
-            vectorizer = pickle.load(f)
+        model, vectorizer = load_model()
     except FileNotFoundError:
         print("Model files not found!")
         return
@@ -0,0 +1,50 @@
+import os
+import time
+import uuid
+
+# Written by the pipeline scripts whenever they rebuild an artifact, read by
+# app.py to notice that its cached state is out of date.
+INDEX_STAMP = os.path.join("chroma_db", "index_version")
+# The model stamp is the bundle's CURRENT pointer (see model_bundle.py).
+MODEL_STAMP = os.path.join("model_bundle", "CURRENT")
+
+
+def new_version():
+    """A fresh version string; versions sort by creation time."""
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def write_stamp(path, version=None):
+    """Record a new version for the artifact guarded by this stamp file."""
+    version = version or new_version()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    return version
+
+
+def read_stamp(path):
+    """Current version of an artifact, or None if it was never stamped."""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+# init_vectordb.py builds each index version in its own directory, named by
+# its stamp, and never writes to one an app may still be reading.
+INDEX_VERSIONS_DIR = os.path.join("chroma_db", "versions")
+
+
+def index_dir(version):
+    """Chroma directory of an index version. Indexes built before versions
+    had their own directories live in chroma_db itself."""
+    path = os.path.join(INDEX_VERSIONS_DIR, version) if version else None
+    return path if path and os.path.isdir(path) else "chroma_db"
+
+
+def current_index_dir():
+    """Chroma directory of the index version init_vectordb.py last published."""
+    return index_dir(read_stamp(INDEX_STAMP))
@@ -1,68 +1,177 @@
 import pandas as pd
+import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import PCA
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.decomposition import IncrementalPCA
+from sklearn.preprocessing import normalize
+import argparse
 import os
+from corpus_cache import iter_corpus
+from version_stamps import current_index_dir
 
-def parse_raw_message(raw_message):
-    lines = raw_message.split('\n')
-    body = []
-    reading_body = False
-    for line in lines:
-        if reading_body:
-            body.append(line)
-        elif line.strip() == "":
-            reading_body = True
-    return "\n".join(body).strip()
-
-def auto_label(text):
-    text = text.lower()
-    financial_keywords = ['budget', 'invoice', 'purchase', 'financial', 'report', 'quarterly', 'bank', 'money', 'expense', 'cost', 'payment', 'transaction', 'audit', 'billing']
-    urgent_keywords = ['urgent', 'immediate', 'emergency', 'deadline', 'breach', 'asap', 'critical', 'alert', 'warning', 'high priority', 'immediate action']
-    hr_keywords = ['hr', 'policies', 'performance', 'review', 'insurance', 'promotion', 'holiday', 'leave', 'benefits', 'hiring', 'salary', 'recruitment', 'onboarding', 'resignation', 'interview']
-    
-    for word in urgent_keywords:
-        if word in text:
-            return 'Urgent'
-    for word in financial_keywords:
-        if word in text:
-            return 'Financial'
-    for word in hr_keywords:
-        if word in text:
-            return 'HR'
-    return 'General'
-
-def visualize():
-    print("Loading data...")
-    try:
-        df = pd.read_csv('emails.csv', nrows=2000) # Use subset for visualization speed
-    except FileNotFoundError:
-        print("emails.csv not found")
-        return
+COMPONENTS = 3
+
+
+class StratifiedSample:
+    """Uniform sample of up to ``per_class`` rows per category from a stream.
+
+    Bottom-k sampling on random keys, as in prototypes.py, so memory is
+    bounded by the sample size however long the stream is.
+    """
+
+    def __init__(self, per_class, rng):
+        self.per_class = per_class
+        self.rng = rng
+        self.samples = {}
+
+    def add(self, labels, rows):
+        labels = np.asarray(labels)
+        for label in np.unique(labels):
+            keys = self.rng.random(int((labels == label).sum()))
+            class_rows = rows[labels == label]
+            if label in self.samples:
+                keys = np.concatenate([self.samples[label][0], keys])
+                class_rows = np.concatenate([self.samples[label][1], class_rows])
+            if len(keys) > self.per_class:
+                keep = np.argpartition(keys, self.per_class - 1)[:self.per_class]
+                keys, class_rows = keys[keep], class_rows[keep]
+            self.samples[label] = (keys, class_rows)
+
+    def rows(self):
+        labels = sorted(self.samples)
+        return ([label for label in labels for _ in self.samples[label][1]],
+                np.concatenate([self.samples[label][1] for label in labels]))
+
+
+def randomized_pca(chunks, n_features, n_components=COMPONENTS, oversample=10, iterations=2, seed=0):
+    """Top principal axes of a sparse matrix streamed in row chunks.
+
+    Randomized subspace iteration on the covariance matrix: every pass over
+    ``chunks()`` multiplies an (n_features x n_components + oversample) basis
+    by X^T X chunk by chunk, and centering is applied afterwards from the
+    column means, so X is never densified or held in memory. The last pass
+    also gives the Rayleigh-Ritz step. Returns (components, mean,
+    explained variance ratio).
+    """
+    rng = np.random.default_rng(seed)
+    basis, _ = np.linalg.qr(rng.standard_normal((n_features, n_components + oversample)))
+    for step in range(iterations + 1):
+        product = np.zeros_like(basis)
+        column_sums = np.zeros(n_features)
+        squared_norms = 0.0
+        rows = 0
+        for X in chunks():
+            product += X.T @ (X @ basis)
+            column_sums += np.asarray(X.sum(axis=0)).ravel()
+            squared_norms += X.multiply(X).sum()
+            rows += X.shape[0]
+        mean = column_sums / rows
+        product -= rows * np.outer(mean, mean @ basis)
+        print(f"Pass {step + 1}/{iterations + 1} over {rows} emails done.")
+        if step < iterations:
+            basis, _ = np.linalg.qr(product)
+
+    eigenvalues, vectors = np.linalg.eigh(basis.T @ product)
+    top = np.argsort(eigenvalues)[::-1][:n_components]
+    total_variance = squared_norms - rows * mean @ mean
+    return (basis @ vectors[:, top]).T, mean, eigenvalues[top] / total_variance
 
-    print("Parsing and Labeling...")
-    df['parsed_content'] = df['message'].apply(parse_raw_message)
-    df['category'] = df['parsed_content'].apply(auto_label)
 
-    print("Vectorizing...")
-    tfidf = TfidfVectorizer(stop_words='english', max_features=1000)
-    matrix = tfidf.fit_transform(df['parsed_content'])
+def _tfidf(vectorizer, texts, idf):
+    return normalize(vectorizer.transform(texts) @ sp.diags(idf))
 
-    print("Running PCA...")
-    pca = PCA(n_components=3)
-    components = pca.fit_transform(matrix.toarray())
+
+def project_tfidf(per_class=500, chunk_size=20000, max_rows=None, n_features=2 ** 18, iterations=2, seed=0):
+    """PCA of TF-IDF vectors over the whole corpus, in bounded memory.
+
+    A stateless HashingVectorizer replaces the fitted vocabulary, the IDF
+    weights come from one counting pass, and the stratified sample to plot
+    is drawn during that same pass. Returns (coordinates, categories).
+    """
+    vectorizer = HashingVectorizer(stop_words='english', n_features=n_features, alternate_sign=False, norm=None)
+    sample = StratifiedSample(per_class, np.random.default_rng(seed))
+    document_frequency = np.zeros(n_features)
+    documents = 0
+    print("Counting document frequencies...")
+    for chunk in iter_corpus(['parsed_content', 'category'], batch_size=chunk_size, max_rows=max_rows):
+        counts = vectorizer.transform(chunk['parsed_content'])
+        document_frequency += np.bincount(counts.indices, minlength=n_features)
+        documents += len(chunk)
+        sample.add(chunk['category'].to_numpy(), chunk['parsed_content'].to_numpy())
+    # Smoothed IDF, the same formula as TfidfVectorizer.
+    idf = np.log((1 + documents) / (1 + document_frequency)) + 1
+
+    def chunks():
+        for chunk in iter_corpus(['parsed_content'], batch_size=chunk_size, max_rows=max_rows):
+            yield _tfidf(vectorizer, chunk['parsed_content'], idf)
+
+    print("Running randomized PCA...")
+    components, mean, explained = randomized_pca(chunks, n_features, iterations=iterations, seed=seed)
+    print(f"Explained variance ratio: {np.round(explained, 4)}")
+    categories, texts = sample.rows()
+    coordinates = _tfidf(vectorizer, texts, idf) @ components.T - mean @ components.T
+    return coordinates, categories
+
+
+def project_embeddings(collection, per_class=500, page_size=5000, seed=0):
+    """PCA of the sentence embeddings stored in a Chroma collection.
+
+    The collection is read page by page into an IncrementalPCA, so memory
+    does not depend on its size. Returns (coordinates, categories).
+    """
+    count = collection.count()
+    if count == 0:
+        raise ValueError("Collection is empty; run init_vectordb.py first.")
+    ipca = IncrementalPCA(n_components=COMPONENTS)
+    sample = StratifiedSample(per_class, np.random.default_rng(seed))
+    for offset in range(0, count, page_size):
+        page = collection.get(limit=page_size, offset=offset, include=['embeddings', 'metadatas'])
+        rows = np.asarray(page['embeddings'], dtype=np.float32)
+        # Each partial_fit needs at least n_components rows.
+        if len(rows) >= COMPONENTS:
+            ipca.partial_fit(rows)
+        sample.add([m.get('category', 'General') for m in page['metadatas']], rows)
+        print(f"Fitted {min(offset + page_size, count)}/{count} embeddings")
+    print(f"Explained variance ratio: {np.round(ipca.explained_variance_ratio_, 4)}")
+    categories, rows = sample.rows()
+    return ipca.transform(rows), categories
+
+
+def visualize(source='tfidf', per_class=500, chunk_size=20000, max_rows=None, n_features=2 ** 18, iterations=2,
+              output_file='pairplot.png', seed=0):
+    print("Loading data...")
+    if source == 'embeddings':
+        import chromadb
+        collection = chromadb.PersistentClient(path=current_index_dir()).get_collection(name="email_collection")
+        components, categories = project_embeddings(collection, per_class, seed=seed)
+    else:
+        if not os.path.exists('emails.csv'):
+            print("emails.csv not found")
+            return
+        components, categories = project_tfidf(per_class, chunk_size, max_rows, n_features, iterations, seed)
 
     viz_df = pd.DataFrame(data=components, columns=['PC1', 'PC2', 'PC3'])
-    viz_df['Category'] = df['category']
+    viz_df['Category'] = categories
 
-    print("Generating Pairplot...")
+    print(f"Generating Pairplot of {len(viz_df)} sampled emails...")
     sns.set_theme(style="ticks")
     pairplot = sns.pairplot(viz_df, hue='Category', palette='bright')
-    
-    output_file = 'pairplot.png'
+
     pairplot.savefig(output_file)
     print(f"Pairplot saved to {output_file}")
 
 if __name__ == "__main__":
-    visualize()
+    parser = argparse.ArgumentParser(description="Plot the emails' first three principal components by category.")
+    parser.add_argument('--source', choices=['tfidf', 'embeddings'], default='tfidf',
+                        help="Project TF-IDF vectors of emails.csv, or the sentence embeddings stored in ChromaDB")
+    parser.add_argument('--per-class', type=int, default=500, help="Emails plotted per category")
+    parser.add_argument('--chunk-size', type=int, default=20000)
+    parser.add_argument('--max-rows', type=int, default=None, help="Stop after this many rows (default: whole corpus)")
+    parser.add_argument('--n-features', type=int, default=2 ** 18, help="Hashed TF-IDF features")
+    parser.add_argument('--iterations', type=int, default=2, help="Power iterations of the randomized PCA")
+    parser.add_argument('-o', '--output', default='pairplot.png')
+    args = parser.parse_args()
+    visualize(args.source, args.per_class, args.chunk_size, args.max_rows, args.n_features, args.iterations,
+              args.output)